@@ -0,0 +1,160 @@
+from src.arbitrage import *
+from random import randint, seed
+from time import perf_counter
+import sys
+import tracemalloc
+
+
+def random_pools(n: int) -> List[Pool]:
+    """Pools with random reserves
+    """
+    pairs = [(pair, dex) for pair, info in pools_info.items() for dex in info if dex != 'native_swap']
+    pools = []
+    for i in range(n):
+        pool = Pool(*pairs[i % len(pairs)])
+        pool.amount1 = Dec(randint(10 ** 9, 10 ** 14))
+        pool.amount2 = Dec(randint(10 ** 9, 10 ** 14))
+        pool.amp = Dec(randint(1, 100))
+        pools.append(pool)
+    return pools
+
+
+async def bench_amm(n=5000, repeat=3):
+    """Integer kernel vs `Dec` simulation on random reserves, best of `repeat` runs
+    """
+    seed(0)
+    pools = random_pools(n)
+    sizes = [Dec(randint(10 ** 6, 10 ** 11)) for _ in pools]
+    kernel_time = sync_time = dec_time = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        exact = [await pool.simulate(pool.token1, size) for pool, size in zip(pools, sizes)]
+        kernel_time = min(kernel_time, perf_counter() - start)
+
+        start = perf_counter()
+        [pool.simulate_sync(pool.token1, size) for pool, size in zip(pools, sizes)]
+        sync_time = min(sync_time, perf_counter() - start)
+
+        start = perf_counter()
+        reference = [await pool.simulate_dec(pool.token1, size) for pool, size in zip(pools, sizes)]
+        dec_time = min(dec_time, perf_counter() - start)
+
+    diff = max(abs(float((a.ask_size - b.ask_size) / b.ask_size)) for a, b in zip(exact, reference))
+    print(f"{n} simulations\n"
+          f"Integer kernel {kernel_time:.3f}s\n"
+          f"Integer kernel without awaits {sync_time:.3f}s\n"
+          f"Dec {dec_time:.3f}s\n"
+          f"Speedup {dec_time / kernel_time:.1f}x, {dec_time / sync_time:.1f}x without awaits\n"
+          f"Max relative difference {diff:.3e}")
+
+
+async def bench_depth(n=10000):
+    """Depth curve by `Pool.simulate_many` vs looping `Pool.simulate`
+    """
+    seed(0)
+    pool = random_pools(1)[0]
+    sizes = np.linspace(10 ** 6, int(pool.amount1) // 10, n).round()
+
+    start = perf_counter()
+    ask_sizes, _, _ = pool.simulate_many(pool.token1, sizes)
+    vectorized_time = perf_counter() - start
+
+    start = perf_counter()
+    swaps = [await pool.simulate(pool.token1, Dec(int(size))) for size in sizes]
+    loop_time = perf_counter() - start
+
+    diff = max(abs(float(swap.ask_size) - ask_size) / ask_size for swap, ask_size in zip(swaps, ask_sizes))
+    print(f"{n}-point depth curve on {pool}\n"
+          f"simulate_many {vectorized_time * 1000:.3f}ms\n"
+          f"simulate {loop_time * 1000:.3f}ms\n"
+          f"Max relative difference {diff:.3e}")
+
+
+def synthetic_graph(n: int) -> TokenGraph:
+    """Random token graph with two hubs connected to every token
+    """
+    graph = TokenGraph('synthetic')
+    for i in range(2, n):
+        graph.add(Pair('t0', f't{i}'))
+        graph.add(Pair('t1', f't{i}'))
+        graph.add(Pair(f't{i}', f't{(i + randint(1, n - 3) - 2) % (n - 2) + 2}'))
+    graph.add(Pair('t0', 't1'))
+    return graph
+
+
+def measure(func):
+    """Time and peak memory of `func()`
+    """
+    tracemalloc.start()
+    start = perf_counter()
+    res = func()
+    elapsed = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return res, elapsed, peak
+
+
+async def bench_routing(n=200):
+    """Bounded-hop search on a synthetic token graph
+    """
+    seed(0)
+    dex = Dex('terra_swap')
+    dex.graph = synthetic_graph(n)
+    bid, ask = 't2', f't{n - 1}'
+    print(f"{n} tokens {len(dex.graph.pairs) // 2} pairs")
+    for hops in range(2, 7):
+        pairs, elapsed, peak = measure(lambda: dex.edges(bid, ask, hops))
+        print(f"edges max_hops={hops}: {len(pairs)} pairs {elapsed * 1000:.3f}ms peak {peak / 1024:.1f}KiB")
+    for hops in range(2, 5):
+        count, elapsed, peak = measure(lambda: sum(1 for _ in dex.dfs(bid, ask, hops)))
+        print(f"dfs max_hops={hops}: {count} routes {elapsed * 1000:.3f}ms peak {peak / 1024:.1f}KiB")
+    # Exhaustive enumeration grows exponentially with tokens.
+    for size in (6, 8, 10, 12):
+        seed(0)
+        dex.graph = synthetic_graph(size)
+        count, elapsed, peak = measure(lambda: len(list(dex.dfs('t2', f't{size - 1}', size))))
+        print(f"exhaustive {size} tokens: {count} routes {elapsed * 1000:.3f}ms peak {peak / 1024:.1f}KiB")
+
+
+async def bench_arbitrage(n=20):
+    """Cycle detection over all pools with random reserves
+
+    Pools are those of the network selected by `consts.testnet`.
+    """
+    seed(0)
+    arbitrage = Arbitrage()
+    print(f"{'Testnet' if testnet else 'Mainnet'} {arbitrage}")
+    elapsed = []
+    for _ in range(n):
+        for pool in arbitrage.pools.values():
+            if pool.dex == 'native_swap':
+                pool.params = {'base_pool': Dec(randint(10 ** 13, 10 ** 14)),
+                               'delta': Dec(0),
+                               'min_stability_spread': Dec('0.005'),
+                               'luna_sdt': Dec(randint(50, 100)),
+                               'luna_ust': Dec(randint(50, 100))}
+                pool.params['sdt_ust'] = pool.params['luna_ust'] / pool.params['luna_sdt']
+                pool.fee = pool.params['min_stability_spread']
+                pool._market_pools()
+            else:
+                pool.amount1 = Dec(randint(10 ** 9, 10 ** 14))
+                pool.amount2 = Dec(randint(10 ** 9, 10 ** 14))
+                pool.amp = Dec(randint(1, 100))
+                pool._invalidate()
+        start = perf_counter()
+        routes = arbitrage.find()
+        elapsed.append(perf_counter() - start)
+    print(f"{n} scans\n"
+          f"Mean {sum(elapsed) / n * 1000:.3f}ms\n"
+          f"Max {max(elapsed) * 1000:.3f}ms\n"
+          f"Last scan {routes[:1]}")
+
+
+benchmarks = {'amm': bench_amm,
+              'depth': bench_depth,
+              'routing': bench_routing,
+              'arbitrage': bench_arbitrage}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or benchmarks:
+        loop.run_until_complete(benchmarks[name]())
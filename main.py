@@ -6,6 +6,8 @@ assert sys.version_info >= (3, 10), print('Python version >=3.10 is required.\nY
 
 async def main():
     async with terra:
+        # Load gas prices and wallet account
+        await init()
         # pprint(await terra.tendermint.node_info())
         # pprint(await terra.tendermint.block_info())
         # pprint(await block_height())
@@ -10,9 +10,10 @@ setup(
     author_email='shuhui.1990+@gmail.com',
     description='',
     python_requires=">=3.10",
-    install_requires=['requests~=2.27.1',
-                      'terra_sdk>=2.0.6',
-                      'attrs~=21.4.0'
+    install_requires=['terra_sdk>=2.0.6',
+                      'attrs~=21.4.0',
                       'pysondb~=1.6.4',
-                      'cerberus~=1.3.4'],
+                      'cerberus~=1.3.4',
+                      'numpy>=1.22',
+                      'aiohttp>=3.8.1'],
 )
@@ -0,0 +1,231 @@
+"""Integer AMM math reproducing the rounding of the on-chain contracts
+
+Amounts are integers in the smallest unit of a token. Decimals are integers scaled
+by `DECIMAL_FRACTIONAL`, the same representation as CosmWasm `Decimal`/`Decimal256`
+and Cosmos SDK `sdk.Dec`.
+"""
+from decimal import Decimal
+from typing import Tuple
+
+DECIMAL_PLACES = 18
+DECIMAL_FRACTIONAL = 10 ** DECIMAL_PLACES
+HALF_FRACTIONAL = DECIMAL_FRACTIONAL // 2
+# Stable swap
+N_COINS = 2
+ITERATIONS = 32
+
+
+def to_decimal(value) -> int:
+    """Convert `float`/`str`/`Dec` to decimal atomics
+    """
+    return int(Decimal(str(value)) * DECIMAL_FRACTIONAL)
+
+
+def from_ratio(numerator: int, denominator: int) -> int:
+    """`Decimal::from_ratio` in CosmWasm
+    """
+    return numerator * DECIMAL_FRACTIONAL // denominator
+
+
+def mul_decimal(amount: int, decimal: int) -> int:
+    """`Uint128 * Decimal` in CosmWasm, rounded down
+    """
+    return amount * decimal // DECIMAL_FRACTIONAL
+
+
+def _chop_precision_and_round(value: int) -> int:
+    """Remove 18 decimals with bankers rounding as in Cosmos SDK
+    """
+    if value < 0:
+        return -_chop_precision_and_round(-value)
+    quo, rem = divmod(value, DECIMAL_FRACTIONAL)
+    if rem > HALF_FRACTIONAL or rem == HALF_FRACTIONAL and quo & 1:
+        quo += 1
+    return quo
+
+
+def sdk_mul(d1: int, d2: int) -> int:
+    """`sdk.Dec.Mul`
+    """
+    return _chop_precision_and_round(d1 * d2)
+
+
+def sdk_quo(d1: int, d2: int) -> int:
+    """`sdk.Dec.Quo`, truncating the intermediate quotient towards zero like `big.Int.Quo`
+    """
+    quo = abs(d1) * DECIMAL_FRACTIONAL * DECIMAL_FRACTIONAL // abs(d2)
+    if (d1 < 0) != (d2 < 0):
+        quo = -quo
+    return _chop_precision_and_round(quo)
+
+
+def constant_product_swap(
+        offer_pool: int,
+        ask_pool: int,
+        offer_amount: int,
+        commission_rate: int
+) -> Tuple[int, int, int]:
+    """`compute_swap` of Terraswap, Astroport XYK, Loop and Prism pairs
+
+    :return: (return_amount, spread_amount, commission_amount)
+    """
+    # offer => ask
+    # ask_amount = (ask_pool - cp / (offer_pool + offer_amount)) * (1 - commission_rate)
+    cp = offer_pool * ask_pool
+    return_amount = (ask_pool * DECIMAL_FRACTIONAL - from_ratio(cp, offer_pool + offer_amount)) // DECIMAL_FRACTIONAL
+    spread_amount = max(mul_decimal(offer_amount, from_ratio(ask_pool, offer_pool)) - return_amount, 0)
+    commission_amount = mul_decimal(return_amount, commission_rate)
+    return return_amount - commission_amount, spread_amount, commission_amount
+
+
+def constant_product_reverse_swap(
+        offer_pool: int,
+        ask_pool: int,
+        ask_amount: int,
+        commission_rate: int
+) -> Tuple[int, int, int]:
+    """`compute_offer_amount` of Terraswap, Astroport XYK, Loop and Prism pairs
+
+    :return: (offer_amount, spread_amount, commission_amount)
+    """
+    # ask => offer
+    # offer_amount = cp / (ask_pool - ask_amount / (1 - commission_rate)) - offer_pool
+    cp = offer_pool * ask_pool
+    inv_one_minus_commission = from_ratio(DECIMAL_FRACTIONAL, DECIMAL_FRACTIONAL - commission_rate)
+    before_commission_deduction = mul_decimal(ask_amount, inv_one_minus_commission)
+    if before_commission_deduction >= ask_pool:
+        raise ValueError('Ask amount exceeds liquidity')
+    offer_amount = cp // (ask_pool - before_commission_deduction) - offer_pool
+    spread_amount = max(mul_decimal(offer_amount, from_ratio(ask_pool, offer_pool)) - before_commission_deduction, 0)
+    commission_amount = mul_decimal(before_commission_deduction, commission_rate)
+    return offer_amount, spread_amount, commission_amount
+
+
+def compute_d(leverage: int, amount_a: int, amount_b: int) -> int:
+    """Stable swap invariant D by Newton's method as in Astroport
+    """
+    sum_x = amount_a + amount_b
+    if sum_x == 0:
+        return 0
+    amount_a_times_coins = amount_a * N_COINS
+    amount_b_times_coins = amount_b * N_COINS
+    d = sum_x
+    for _ in range(ITERATIONS):
+        d_product = d * d // amount_a_times_coins * d // amount_b_times_coins
+        d_previous = d
+        # d = (leverage * sum_x + d_p * n) * d / ((leverage - 1) * d + (n + 1) * d_p)
+        d = (leverage * sum_x + d_product * N_COINS) * d // (d * (leverage - 1) + d_product * (N_COINS + 1))
+        if d == d_previous:
+            break
+    return d
+
+
+def compute_new_balance_out(leverage: int, new_source_amount: int, d: int) -> int:
+    """Balance of the other coin keeping D constant as in Astroport
+    """
+    # c = D ** (n + 1) / (n ** (2 * n) * prod' * A)
+    c = d ** (N_COINS + 1) // (new_source_amount * N_COINS * N_COINS * leverage)
+    # b = sum' - (A*n**n - 1) * D / (A * n**n)
+    b = new_source_amount + d // leverage
+    # Solve for y by approximating: y**2 + b*y = c
+    y = d
+    for _ in range(ITERATIONS):
+        y_prev = y
+        y = (y * y + c) // (y * 2 + b - d)
+        if y == y_prev:
+            break
+    return y
+
+
+def stable_swap(
+        offer_pool: int,
+        ask_pool: int,
+        offer_amount: int,
+        amp: int,
+        commission_rate: int,
+        d: int | None = None
+) -> Tuple[int, int, int]:
+    """`compute_swap` of Astroport stable pairs
+
+    :return: (return_amount, spread_amount, commission_amount)
+    """
+    leverage = amp * N_COINS
+    if d is None:
+        d = compute_d(leverage, offer_pool, ask_pool)
+    return_amount = ask_pool - compute_new_balance_out(leverage, offer_pool + offer_amount, d)
+    # We consider swap rate 1:1 in stable swap
+    spread_amount = max(offer_amount - return_amount, 0)
+    commission_amount = mul_decimal(return_amount, commission_rate)
+    return return_amount - commission_amount, spread_amount, commission_amount
+
+
+def stable_reverse_swap(
+        offer_pool: int,
+        ask_pool: int,
+        ask_amount: int,
+        amp: int,
+        commission_rate: int,
+        d: int | None = None
+) -> Tuple[int, int, int]:
+    """`compute_offer_amount` of Astroport stable pairs
+
+    :return: (offer_amount, spread_amount, commission_amount)
+    """
+    leverage = amp * N_COINS
+    if d is None:
+        d = compute_d(leverage, offer_pool, ask_pool)
+    inv_one_minus_commission = from_ratio(DECIMAL_FRACTIONAL, DECIMAL_FRACTIONAL - commission_rate)
+    before_commission_deduction = mul_decimal(ask_amount, inv_one_minus_commission)
+    if before_commission_deduction >= ask_pool:
+        raise ValueError('Ask amount exceeds liquidity')
+    offer_amount = compute_new_balance_out(leverage, ask_pool - before_commission_deduction, d) - offer_pool
+    spread_amount = max(offer_amount - before_commission_deduction, 0)
+    commission_amount = mul_decimal(before_commission_deduction, commission_rate)
+    return offer_amount, spread_amount, commission_amount
+
+
+def internal_swap(amount: int, offer_rate: int, ask_rate: int) -> int:
+    """`ComputeInternalSwap` of the market module with Luna exchange rates
+    """
+    if offer_rate == ask_rate:
+        return amount
+    return sdk_quo(sdk_mul(amount, ask_rate), offer_rate)
+
+
+def market_swap(
+        offer_amount: int,
+        luna_offer: bool,
+        offer_rate: int,
+        ask_rate: int,
+        sdr_rate: int,
+        base_pool: int,
+        terra_pool_delta: int,
+        min_spread: int
+) -> Tuple[int, int, int]:
+    """`ComputeSwap` of Terra market module for Terra<>Luna swaps
+
+    Rates are Luna exchange rates of the offer/ask denominations, `DECIMAL_FRACTIONAL` for Luna.
+
+    :return: (return_amount, spread, commission_amount) where spread is a decimal
+    """
+    offer_amount *= DECIMAL_FRACTIONAL
+    # Swap offer coin to base denom for simplicity of swap process
+    base_offer_amount = internal_swap(offer_amount, offer_rate, sdr_rate)
+    # Get swap amount based on the oracle price
+    return_amount = internal_swap(base_offer_amount, sdr_rate, ask_rate)
+    # Constant-product, which by construction is square of base(equilibrium) pool
+    cp = sdk_mul(base_pool, base_pool)
+    terra_pool = base_pool + terra_pool_delta
+    luna_pool = sdk_quo(cp, terra_pool)
+    if luna_offer:
+        # Luna->Terra swap
+        offer_pool, ask_pool = luna_pool, terra_pool
+    else:
+        # Terra->Luna swap
+        offer_pool, ask_pool = terra_pool, luna_pool
+    # askBaseAmount = askPool - cp / (offerPool + offerBaseAmount)
+    ask_base_amount = ask_pool - sdk_quo(cp, offer_pool + base_offer_amount)
+    # spread = (baseOfferAmt - baseAskAmt) / baseOfferAmt
+    spread = max(sdk_quo(base_offer_amount - ask_base_amount, base_offer_amount), min_spread)
+    commission_amount = sdk_mul(spread, return_amount)
+    return (return_amount - commission_amount) // DECIMAL_FRACTIONAL, spread, commission_amount // DECIMAL_FRACTIONAL
@@ -0,0 +1,138 @@
+from src.dex import *
+from math import log, sqrt
+
+# Tokens preferred to start arbitrage cycles
+base_tokens = ('ust', 'luna')
+# Tolerance of relaxations in Bellman-Ford
+epsilon = 1e-12
+
+
+class Arbitrage:
+    """Scanner of profitable cycles across all DEXes
+    """
+    __slots__ = ('dex', 'pools')
+
+    def __init__(self):
+        self.dex = MultiDex()
+        self.pools = self.dex.pools_from_pairs(self.dex.graph.pairs.values())
+
+    def __repr__(self):
+        return f"Arbitrage({len(self.dex.graph.tokens)} tokens, {len(self.pools)} pools)"
+
+    def _liquid(self) -> Dict[Tuple[Pair, str], Pool]:
+        """Pools with liquidity
+        """
+        return {key: pool for key, pool in self.pools.items()
+                if pool.amount1 != Dec(0) and pool.amount2 != Dec(0)}
+
+    def rates(self, pools: Dict[Tuple[Pair, str], Pool]) -> Dict[Tuple[int, int], float]:
+        """Best marginal rate net of fees in each direction of a pair
+        """
+        graph = self.dex.graph
+        rates = {}
+        for (i, j), pair in graph.pairs.items():
+            hop = self.dex.hop(pair, pools)
+            if hop:
+                rates[i, j] = max(pool._float_swap(graph.tokens[i], 0.)[1] for pool in hop)
+        return rates
+
+    def cycles(self, rates: Dict[Tuple[int, int], float]) -> List[Tuple]:
+        """Cycles with a product of rates above 1 by Bellman-Ford on -log(rate)
+
+        All tokens start at distance 0 as if connected to a virtual source.
+        """
+        graph = self.dex.graph
+        n = len(graph.tokens)
+        weights = {edge: -log(rate) for edge, rate in rates.items() if rate > 0}
+        distance = [0.] * n
+        predecessor = [-1] * n
+        updated = []
+        for _ in range(n):
+            updated = []
+            for (i, j), weight in weights.items():
+                if distance[i] + weight < distance[j] - epsilon:
+                    distance[j] = distance[i] + weight
+                    predecessor[j] = i
+                    updated.append(j)
+            if not updated:
+                return []
+        cycles = {}
+        for node in updated:
+            # Walk back onto the cycle
+            for _ in range(n):
+                node = predecessor[node]
+            cycle = [node]
+            token = predecessor[node]
+            while token != node and len(cycle) <= n:
+                cycle.append(token)
+                token = predecessor[token]
+            if token != node:
+                continue
+            cycle.reverse()
+            # Start from a base token if any
+            start = min(range(len(cycle)), key=lambda k: (graph.tokens[cycle[k]] not in base_tokens,
+                                                           graph.tokens[cycle[k]] != 'ust', cycle[k]))
+            cycle = cycle[start:] + cycle[:start]
+            if sum(weights[cycle[k - 1], cycle[k]] for k in range(1, len(cycle))) + \
+                    weights[cycle[-1], cycle[0]] < -epsilon:
+                cycles[tuple(graph.tokens[k] for k in cycle + cycle[:1])] = None
+        return list(cycles)
+
+    def optimal_size(self, cycle: Tuple, pools: Dict[Tuple[Pair, str], Pool]) -> float:
+        """Input maximizing the profit of `cycle` in float
+
+        Profit is concave in size.
+        """
+        hops = [self.dex.hop(self.dex.graph.pair(cycle[k], cycle[k + 1]), pools) for k in range(len(cycle) - 1)]
+        if all(len(hop) == 1 and not hop[0].stable and hop[0].dex != 'native_swap' for hop in hops):
+            # receive = a * size / (b + c * size) has slope 1 at sqrt(a * b) - b over c.
+            a, b, c = 1., 1., 0.
+            for token, (pool,) in zip(cycle, hops):
+                xi, yi = (float(amount) for amount in pool._xy(token))
+                a, b, c = (1 - pool.fee) * yi * a, xi * b, xi * c + a
+            return max((sqrt(a * b) - b) / c, 0.)
+
+        def profit(size: float) -> float:
+            return self.dex._float_output(cycle, size, pools) - size
+
+        # Bracket the maximum
+        high = 1.
+        for _ in range(128):
+            if profit(high * 2) <= profit(high):
+                break
+            high *= 2
+        # Golden section search
+        ratio = (sqrt(5) - 1) / 2
+        low, high = 0., high * 2
+        for _ in range(64):
+            left = high - ratio * (high - low)
+            right = low + ratio * (high - low)
+            if profit(left) < profit(right):
+                low = left
+            else:
+                high = right
+        return (low + high) / 2
+
+    def find(self) -> List[Route]:
+        """Profitable cycles on queried liquidity, the most profitable first
+        """
+        pools = self._liquid()
+        routes = []
+        for cycle in self.cycles(self.rates(pools)):
+            size = int(self.optimal_size(cycle, pools))
+            if size > 0:
+                route = self.dex._evaluate(cycle, Dec(size), pools)
+                if route.trade.ask_size > route.trade.bid_size:
+                    routes.append(route)
+        routes.sort(key=lambda route: route.trade.ask_size - route.trade.bid_size, reverse=True)
+        return routes
+
+    async def scan(self) -> RouteSearch:
+        """Query pools not queried in this block in one batch and find profitable cycles
+
+        :return: RouteSearch(routes, elapsed) with routes for `MultiDex.route_to_msg`
+        """
+        start = perf_counter()
+        await pool_store.load(self.pools.values())
+        routes = self.find()
+        return RouteSearch(routes=routes, elapsed=perf_counter() - start)
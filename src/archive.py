@@ -0,0 +1,182 @@
+from src.pool import *
+import os
+
+# Reserves of a pool after a block, as low and high 64-bit words to fit tokens of 18 decimals
+reserve_dtype = np.dtype([('height', '<u4'),
+                          ('time', '<u4'),
+                          ('pool', '<u2'),
+                          ('amp', '<u4'),
+                          ('amount1', '<u8', (2,)),
+                          ('amount2', '<u8', (2,))])
+word_mask = (1 << 64) - 1
+# Market module parameters after a block
+market_dtype = np.dtype([('height', '<u4'),
+                         ('time', '<u4'),
+                         ('base_pool', '<f8'),
+                         ('delta', '<f8'),
+                         ('luna_sdt', '<f8'),
+                         ('luna_ust', '<f8'),
+                         ('min_stability_spread', '<f8'),
+                         ('pool_recovery_period', '<f8')])
+
+
+def to_words(amount: int) -> Tuple[int, int]:
+    """Low and high 64-bit words of a reserve
+    """
+    if not 0 <= amount < 1 << 128:
+        raise ValueError(f"Reserve {amount} doesn't fit in 128 bits")
+    return amount & word_mask, amount >> 64
+
+
+def from_words(words: Iterable[int]) -> int:
+    low, high = words
+    return int(low) | int(high) << 64
+
+
+def block_time(block: Dict) -> int:
+    """Unix time of a block
+    """
+    return int(header_time(block))
+
+
+class SnapshotArchive:
+    """Append-only archive of pool states per block
+
+    Rows have fixed width and are appended in order of height. Readers memory map the files.
+    """
+    __slots__ = ('path', 'keys', 'ids', 'maps', 'index')
+
+    def __init__(self, path='archive'):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        # Pool IDs by order of first appearance
+        try:
+            with open(self._file('pools.json')) as f:
+                self.keys: List[str] = json.load(f)
+        except FileNotFoundError:
+            self.keys = []
+        self.ids = {key: i for i, key in enumerate(self.keys)}
+        # Memory maps by file name
+        self.maps: Dict[str, np.ndarray] = {}
+        # Reserve row offsets by pool ID
+        self.index: Dict[int, np.ndarray] | None = None
+
+    def __repr__(self):
+        return f"SnapshotArchive({self.path}, {len(self.keys)} pools)"
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @staticmethod
+    def key(pool: Pool) -> str:
+        return f"{pool.token1}/{pool.token2}/{pool.dex}"
+
+    def pool_id(self, pool: Pool) -> int:
+        """ID of `pool`, assigned on first sight
+        """
+        key = self.key(pool)
+        try:
+            return self.ids[key]
+        except KeyError:
+            i = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+            with open(self._file('pools.json'), 'w') as f:
+                json.dump(self.keys, f)
+            return i
+
+    def pool(self, i: int) -> Tuple[Pair, str]:
+        """Pair and DEX of pool ID `i`
+        """
+        token1, token2, dex = self.keys[i].split('/')
+        return Pair(token1, token2), dex
+
+    def append(self, height: int, time: int, pools: Iterable[Pool]):
+        """Record `pools` after block `height`
+        """
+        rows, market = [], []
+        for pool in pools:
+            if pool.dex == 'native_swap':
+                if 'base_pool' in pool.params:
+                    params = pool.params
+                    market.append((height, time, float(params['base_pool']), float(params['delta']),
+                                   float(params['luna_sdt']), float(params['luna_ust']),
+                                   float(params['min_stability_spread']), float(params['pool_recovery_period'])))
+            elif pool.amount1 != Dec(0):
+                rows.append((height, time, self.pool_id(pool), int(pool.amp),
+                             to_words(int(pool.amount1)), to_words(int(pool.amount2))))
+        with open(self._file('reserves.bin'), 'ab') as f:
+            np.array(rows, dtype=reserve_dtype).tofile(f)
+        with open(self._file('market.bin'), 'ab') as f:
+            np.array(market, dtype=market_dtype).tofile(f)
+        self.maps.clear()
+        self.index = None
+
+    def record(self, block: Dict, pools: Iterable[Pool]):
+        """Record `pools` after a block of `BlockChain`
+        """
+        self.append(int(block['header']['height']), block_time(block), pools)
+
+    def _memmap(self, name: str, dtype: np.dtype) -> np.ndarray:
+        """Memory map of file `name`, kept until the next `append`
+        """
+        try:
+            return self.maps[name]
+        except KeyError:
+            pass
+        file = self._file(name)
+        if not os.path.exists(file) or os.path.getsize(file) < dtype.itemsize:
+            rows = np.zeros(0, dtype=dtype)
+        else:
+            rows = np.memmap(file, dtype=dtype, mode='r')
+        self.maps[name] = rows
+        return rows
+
+    @staticmethod
+    def _bounds(rows: np.ndarray, start: int, end: int | None) -> Tuple[int, int]:
+        """Offsets of rows with `start` <= height < `end` by binary search
+        """
+        heights = rows['height']
+        low = np.searchsorted(heights, start, 'left')
+        high = len(rows) if end is None else np.searchsorted(heights, end, 'left')
+        return int(low), int(high)
+
+    def _pool_index(self, rows: np.ndarray) -> Dict[int, np.ndarray]:
+        """Ascending offsets of the reserve rows of each pool, kept until the next `append`
+        """
+        if self.index is None:
+            ids = np.asarray(rows['pool'])
+            order = np.argsort(ids, kind='stable')
+            pools, counts = np.unique(ids[order], return_counts=True)
+            self.index = dict(zip(pools.tolist(), np.split(order, np.cumsum(counts)[:-1])))
+        return self.index
+
+    def reserves(self, start=0, end=None, pool: Pool | int | None = None) -> np.ndarray:
+        """Reserve rows of blocks in [`start`, `end`), of one pool if given
+
+        Rows of all pools are a view of the file. Rows of one pool are looked up by offset and are
+        a strided view when evenly spaced, as when the same pools are recorded every block, or a copy
+        of only those rows otherwise.
+        """
+        rows = self._memmap('reserves.bin', reserve_dtype)
+        low, high = self._bounds(rows, start, end)
+        if pool is None:
+            return rows[low:high]
+        if isinstance(pool, Pool):
+            pool = self.ids.get(self.key(pool))
+        offsets = self._pool_index(rows).get(pool)
+        if offsets is None:
+            return rows[:0]
+        offsets = offsets[np.searchsorted(offsets, low):np.searchsorted(offsets, high)]
+        if len(offsets) < 2:
+            return rows[offsets[0]:offsets[0] + 1] if len(offsets) else rows[:0]
+        step = int(offsets[1] - offsets[0])
+        if (np.diff(offsets) == step).all():
+            return rows[offsets[0]:offsets[-1] + 1:step]
+        return rows[offsets]
+
+    def market(self, start=0, end=None) -> np.ndarray:
+        """Market module rows of blocks in [`start`, `end`) without copying
+        """
+        rows = self._memmap('market.bin', market_dtype)
+        low, high = self._bounds(rows, start, end)
+        return rows[low:high]
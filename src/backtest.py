@@ -0,0 +1,200 @@
+from src.order import *
+
+
+@attr.s(repr=False, slots=True)
+class Fill:
+    order: LimitOrder = attr.ib()
+    height: int = attr.ib()
+    route: Route = attr.ib()
+    # Minimum output of the order when submitted
+    limit: Dec = attr.ib()
+
+    @property
+    def slippage(self) -> Dec:
+        """Spread of the fill to the marginal price
+        """
+        return self.route.trade.spread
+
+    @property
+    def pnl(self) -> Dec:
+        """Output gained over the limit of the order
+        """
+        return self.route.trade.ask_size - self.limit
+
+    def __repr__(self):
+        trade = self.route.trade
+        return f"Fill({self.order.id} at {self.height}: {trade.float_bid()} {trade.bid} -> " \
+               f"{trade.float_ask()} {trade.ask}, slippage {float(self.slippage):.4%}, " \
+               f"P&L {from_Dec(self.pnl, trade.ask)} {trade.ask})"
+
+
+@attr.s(slots=True)
+class Backtest(OrderBook):
+    """Replay of archived pool states through the orders of an `OrderBook` without network
+
+    Orders are matched only in blocks changing one of their pools, and limit orders are routed only
+    if the marginal prices of their pools allow an output above the limit. Pools and routes are kept
+    apart from the live `pool_store` and `route_cache`.
+    """
+    snapshots: SnapshotArchive | None = attr.ib(default=None)
+    store: PoolStateStore = attr.ib(factory=PoolStateStore)
+    sync: ReserveSync = attr.ib(default=attr.Factory(lambda self: ReserveSync(self.store), takes_self=True))
+    routes: RouteCache = attr.ib(factory=RouteCache)
+    fills: List[Fill] = attr.ib(factory=list)
+    limits: Dict[str, Dec] = attr.ib(factory=dict)
+    # Hops of the routes of each order
+    order_routes: Dict[str, List[List[Tuple[Pair, str]]]] = attr.ib(factory=dict)
+    order_pools: Dict[str, set] = attr.ib(factory=dict)
+    # Condition orders notified since they were last matched
+    notified: set = attr.ib(factory=set)
+
+    def submit(self, order: LimitOrder):
+        OrderBook.submit(self, order)
+        self.order_pools[order.id] = set(self.dex.pools_from_pairs(self.dex.edges(order.bid, order.ask),
+                                                                   self.store).values())
+        self.order_routes[order.id] = [[(self.dex.graph.pair(route[i], route[i + 1]), route[i])
+                                        for i in range(len(route) - 1)]
+                                       for route in self.dex.dfs(order.bid, order.ask)]
+        self.limits[order.id] = order.ask_size
+
+    async def fill(self, order: LimitOrder, route: Route, height=0):
+        """Fill at the simulated output and move the pools
+        """
+        for swap in route.swaps:
+            for pool in self.dex.hop(self.dex.graph.pair(swap.bid, swap.ask), self.pools):
+                if pool.dex == swap.dex:
+                    await pool.simulate_msg(swap)
+        order.status = 'filled'
+        order.ask_size = route.trade.ask_size
+        self.fills.append(Fill(order, height, route, self.limits[order.id]))
+        self.filled[order.id] = order
+        self.open.pop(order.id, None)
+        self.cancel(order.id)
+        for _order in self.open.values():
+            if isinstance(_order, ConditionOrder):
+                _order.notify(order.id)
+                self.notified.add(_order.id)
+
+    def _load(self, rows: np.ndarray, tracked: Dict[int, Pool], state: Dict[Pool, Tuple]) -> set:
+        """Set reserves of tracked pools from rows of a block
+
+        :return: changed pools
+        """
+        changed = set()
+        for pool_id, amp, amount1, amount2 in zip(rows['pool'].tolist(), rows['amp'].tolist(),
+                                                  rows['amount1'].tolist(), rows['amount2'].tolist()):
+            pool = tracked.get(pool_id)
+            amount1, amount2 = from_words(amount1), from_words(amount2)
+            if pool is not None and state.get(pool) != (amp, amount1, amount2):
+                state[pool] = amp, amount1, amount2
+                pool.amp, pool.amount1, pool.amount2 = Dec(amp), Dec(amount1), Dec(amount2)
+                pool._invalidate()
+                changed.add(pool)
+        return changed
+
+    @staticmethod
+    def _load_market(row: np.void, pool: Pool, state: Dict[Pool, Tuple]) -> bool:
+        """Set market module parameters from a row
+
+        :return: whether they changed
+        """
+        params = tuple(row[name].item() for name in market_dtype.names[2:])
+        if state.get(pool) == params:
+            return False
+        state[pool] = params
+        pool.params = dict(zip(market_dtype.names[2:], (Dec(value) for value in params)))
+        pool.params['sdt_ust'] = pool.params['luna_ust'] / pool.params['luna_sdt']
+        pool.fee = pool.params['min_stability_spread']
+        pool._market_pools()
+        pool.recovered = False
+        return True
+
+    async def run(self, start=0, end=None) -> List[Fill]:
+        """Match orders on archived blocks in [`start`, `end`)
+        """
+        rows = self.snapshots.reserves(start, end)
+        market = self.snapshots.market(start, end)
+        if not len(rows):
+            return self.fills
+        tracked = {}
+        native_swap = None
+        missing = set()
+        for pools in self.order_pools.values():
+            for pool in pools:
+                if pool.dex == 'native_swap':
+                    native_swap = pool
+                    if not len(market):
+                        missing.add(pool)
+                elif self.snapshots.key(pool) in self.snapshots.ids:
+                    tracked[self.snapshots.ids[self.snapshots.key(pool)]] = pool
+                else:
+                    missing.add(pool)
+        if missing:
+            raise ValueError(f"Pools not in {self.snapshots}: {', '.join(map(str, missing))}")
+        state = {}
+        heights = rows['height']
+        cuts = np.flatnonzero(np.diff(heights)) + 1
+        for low, high in zip(np.concatenate(([0], cuts)).tolist(), np.concatenate((cuts, [len(rows)])).tolist()):
+            height = int(heights[low])
+            changed = self._load(rows[low:high], tracked, state)
+            if native_swap is not None:
+                i = np.searchsorted(market['height'], height)
+                if i < len(market) and market['height'][i] == height and \
+                        self._load_market(market[i], native_swap, state):
+                    changed.add(native_swap)
+            if not changed or any(pool.amount1 == Dec(0) for pool in self.pools.values()):
+                continue
+            await self.match(height, changed)
+            if not self.open:
+                break
+        return self.fills
+
+    def _out_of_range(self, order: LimitOrder | ConditionOrder) -> bool:
+        """Whether the output of a limit order is bounded by its limit at the marginal prices of its routes
+        """
+        limit = order.order if isinstance(order, ConditionOrder) else order
+        if type(limit) is not LimitOrder:
+            return False
+        spots = {}
+        best = 0.
+        for route in self.order_routes[order.id]:
+            spot = 1.
+            for hop in route:
+                if hop not in spots:
+                    pair, bid = hop
+                    spots[hop] = max(pool._float_swap(bid, 0.)[1] for pool in self.dex.hop(pair, self.pools))
+                spot *= spots[hop]
+            best = max(best, spot)
+        # Margin for float rounding
+        return float(limit.bid_size) * best * (1 + 1e-9) <= float(limit.ask_size)
+
+    async def match(self, height: int, changed: set):
+        """Match open orders with a changed pool, or notified since last matched
+        """
+        for order in list(self.open.values()):
+            if order.id not in self.open:
+                continue
+            if order.id in self.notified:
+                self.notified.discard(order.id)
+            elif not self.order_pools[order.id] & changed:
+                continue
+            if isinstance(order, ConditionOrder) and not all(order.condition.values()) or \
+                    self._out_of_range(order):
+                continue
+            route = await order.match(self.pools, self.routes)
+            if route:
+                await self.fill(order, route, height)
+
+    def report(self):
+        """Print fills, slippage and P&L
+        """
+        for fill in self.fills:
+            print(fill)
+        print(f"{len(self.fills)} filled, {len(self.open)} open")
+        if self.fills:
+            print(f"Mean slippage {float(sum(fill.slippage for fill in self.fills)) / len(self.fills):.4%}")
+            pnl = Coins()
+            for fill in self.fills:
+                pnl += Coins({fill.route.trade.ask: fill.pnl})
+            # `Coins` drops zero amounts.
+            print(f"P&L {from_Dec(pnl) if pnl else 0}")
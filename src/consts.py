@@ -1,6 +1,8 @@
 testnet = True
 max_spread = 0.5
 slippage = 0.003
+# Maximum number of swaps in a route
+max_hops = 4
 native_tokens = {'ust': 'uusd',
                  'luna': 'uluna'}
 
@@ -0,0 +1,153 @@
+from src.pool import *
+
+crawler_path = 'crawler.json'
+# Maximum page size of factory queries
+page_limit = 30
+# Seconds between full crawls
+full_crawl_period = 86400
+# Fee of constant product pools of factories without fee config, as in the Terraswap contracts
+default_fee = 0.003
+
+
+def asset_key(asset_info: Dict) -> Tuple[str, bool]:
+    """Contract or denomination of an asset and whether it's native
+    """
+    native = any('native' in asset for asset in asset_info)
+    for value in flatten(asset_info):
+        if isinstance(value, str):
+            return value, native
+    raise ValueError(asset_info)
+
+
+class FactoryCrawler:
+    """Discovery of pairs from factory contracts into `registry`
+
+    Factories are paged concurrently. The last pair of each factory is kept so that later crawls
+    only fetch the pages after it. Factories order pairs by their asset infos rather than by creation,
+    so a new pair sorting before the cursor is only found by a full crawl, run every `full_crawl_period`.
+    """
+    __slots__ = ('path', 'cursors', 'crawled', 'semaphore', 'queries')
+
+    def __init__(self, path=crawler_path, concurrency=8):
+        self.path = path
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        # Asset infos of the last pair seen on each DEX
+        self.cursors: Dict[str, List[Dict]] = state.get('cursors', {})
+        # Time of the last full crawl
+        self.crawled: float = state.get('crawled', 0.)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.queries = 0
+
+    def __repr__(self):
+        return f"FactoryCrawler({len(self.cursors)} factories, {self.queries} queries)"
+
+    async def _query(self, contract: str, msg: Dict) -> Dict:
+        async with self.semaphore:
+            self.queries += 1
+            return await terra.wasm.contract_query(contract, msg)
+
+    async def pairs(self, dex: str) -> List[Dict]:
+        """Pairs of `dex` factory after its cursor
+        """
+        pairs = []
+        cursor = self.cursors.get(dex)
+        while True:
+            query = {'limit': page_limit}
+            if cursor:
+                query['start_after'] = cursor
+            try:
+                page = (await self._query(factory[dex], {'pairs': query}))['pairs']
+            except LCDResponseError as exc:
+                print(f"Exception in {type(self).__name__}.pairs\n{exc}")
+                break
+            pairs += page
+            if page:
+                cursor = self.cursors[dex] = page[-1]['asset_infos']
+            if len(page) < page_limit:
+                return pairs
+        return pairs
+
+    async def token_info(self, contract: str) -> Dict | None:
+        try:
+            return await self._query(contract, ABI.self('token_info'))
+        except LCDResponseError as exc:
+            print(f"Exception in {type(self).__name__}.token_info\n{exc}")
+
+    async def fees(self, dex: str) -> Dict[str, float]:
+        """Fee of each pair type in the factory config, empty if the factory has none
+        """
+        try:
+            config = await self._query(factory[dex], ABI.self('config'))
+        except LCDResponseError as exc:
+            print(f"Exception in {type(self).__name__}.fees\n{exc}")
+            return {}
+        return {pair_type: pair_config['total_fee_bps'] / 10000
+                for pair_config in config.get('pair_configs', []) if 'total_fee_bps' in pair_config
+                for pair_type in pair_config['pair_type']}
+
+    @staticmethod
+    def pool_info(dex: str, pair: Dict, fees: Dict[str, float]) -> Dict:
+        """Entry of `pools_info` of a factory pair
+
+        The fee is that of the pair type in `fees`, or else of registered pools of `dex` alike.
+        """
+        pair_type = next(iter(pair.get('pair_type', {'xyk': {}})))
+        stable = pair_type == 'stable'
+        if pair_type in fees:
+            fee = fees[pair_type]
+        else:
+            dex_id = registry.dex_ids.get(dex)
+            alike = registry.pools[(registry.pools['dex'] == dex_id) & (registry.pools['stable'] == stable)]
+            fee = float(alike['fee'][0]) if dex_id is not None and len(alike) else default_fee
+        return {'contract': pair['contract_addr'], 'fee': fee, 'tx_fee': 0, 'stable': stable}
+
+    async def crawl(self, full=False) -> int:
+        """Register new pairs of all factories and cache the registry
+
+        :param full: crawl from the first pair instead of the cursors, as done every `full_crawl_period`
+        :return: number of new pools
+        """
+        if full or time.time() - self.crawled >= full_crawl_period:
+            self.cursors.clear()
+            self.crawled = time.time()
+        dexes = list(factory)
+        res = await asyncio.gather(*(self.pairs(dex) for dex in dexes), *(self.fees(dex) for dex in dexes))
+        pairs = dict(zip(dexes, res[:len(dexes)]))
+        fees = dict(zip(dexes, res[len(dexes):]))
+        # Decimals of unknown CW20 tokens
+        assets = {asset_key(asset) for res in pairs.values() for pair in res for asset in pair['asset_infos']}
+        contracts = [key for key, native in assets if not native and key not in registry.denom_ids]
+        infos = await asyncio.gather(*(self.token_info(contract) for contract in contracts))
+        tokens = {}
+        for contract, info in zip(contracts, infos):
+            if info:
+                symbol = info['symbol'].lower()
+                # Symbols aren't unique.
+                token = contract if symbol in registry.token_ids or symbol in tokens else symbol
+                tokens[token] = {'contract': contract, 'decimals': info['decimals'], 'dex': ()}
+        for key, native in assets:
+            if native and key not in registry.denom_ids:
+                tokens[key] = {'denom': key, 'decimals': 6, 'dex': ()}
+        registry.merge(tokens, {})
+        tokens_info.update(tokens)
+        token_contract_map.update({info['contract']: token for token, info in tokens.items() if 'contract' in info})
+        new = {}
+        for dex, res in pairs.items():
+            for pair in res:
+                symbols = [registry.token_from_contract(key) for key, _ in map(asset_key, pair['asset_infos'])]
+                if None not in symbols and symbols[0] != symbols[1]:
+                    pair_key = Pair(*symbols)
+                    if not registry.has(pair_key, dex):
+                        new.setdefault(pair_key, {})[dex] = self.pool_info(dex, pair, fees[dex])
+        registry.merge({}, new)
+        for pair, dexes in new.items():
+            for dex, info in dexes.items():
+                register_pool(pair, dex, info)
+        registry.save()
+        with open(self.path, 'w') as f:
+            json.dump({'cursors': self.cursors, 'crawled': self.crawled}, f)
+        return sum(map(len, new.values()))
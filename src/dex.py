@@ -1,8 +1,18 @@
 from src.pool import *
 from collections import namedtuple
+from heapq import nlargest
+from itertools import chain
+from math import floor, log, log1p
+from time import perf_counter
 import attr
+import re
 
 Hop = namedtuple('Hop', ['bid', 'ask', 'dex'])
+# Message of a block trading on a `Pool` or, through its router, a `Dex`
+SwapMsg = namedtuple('SwapMsg', ['target', 'msg'])
+
+# Relative width of bid size buckets sharing a cached route
+size_bucket = 0.05
 
 
 @attr.s(slots=True)
@@ -26,11 +36,97 @@ class Route:
         return f"Route({' -> '.join(strings)} on {self.trade.dex})"
 
 
+@attr.s(repr=False, slots=True)
+class RouteSearch:
+    routes: List[Route] = attr.ib()
+    elapsed: float = attr.ib()
+
+    @property
+    def best(self) -> Route:
+        return self.routes[0]
+
+    def __repr__(self):
+        routes = '\n'.join(f"  {route}" for route in self.routes)
+        return f"RouteSearch({len(self.routes)} routes in {self.elapsed * 1000:.3f}ms\n{routes})"
+
+
+class RouteCache:
+    """Routes memoized per pool state version and bid size bucket
+    """
+    __slots__ = ('routes', 'stats', 'version')
+
+    def __init__(self):
+        self.routes: Dict[Tuple, Route] = {}
+        self.stats = CacheStats()
+        self.version = pool_states.version
+
+    def __repr__(self):
+        return f"RouteCache({len(self.routes)} routes, {self.stats})"
+
+    @staticmethod
+    def key(dex: str, bid: str, bid_size: Dec, ask: str, max_hops: int) -> Tuple:
+        bucket = floor(log(max(float(bid_size), 1.)) / log1p(size_bucket))
+        return dex, bid, ask, bucket, max_hops
+
+    def get(self, key: Tuple) -> Route | None:
+        """Cached route if no reserve changed since
+        """
+        if self.version != pool_states.version:
+            self.routes.clear()
+            self.version = pool_states.version
+        route = self.routes.get(key)
+        if route is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+        return route
+
+    def put(self, key: Tuple, route: Route):
+        if self.version == pool_states.version:
+            self.routes[key] = route
+
+
+route_cache = RouteCache()
+
+
+def router_msg(
+        contract: AccAddress,
+        swaps: List[Swap],
+        minimum_receive: Dec
+) -> List[Msg]:
+    """`execute_swap_operations` message of a router contract
+    """
+    bid, bid_size = swaps[0].bid, swaps[0].bid_size
+    operations = []
+    for swap in swaps:
+        if swap.dex == 'native_swap':
+            operation = ABI.native_swap(swap.bid, swap.ask)
+        else:
+            operation = ABI.dex_swap(swap.dex, swap.bid, swap.ask)
+        operations.append(operation)
+    msg = ABI.execute_swap_operations(bid_size,
+                                      minimum_receive,
+                                      f'{max_spread}',
+                                      operations)
+    # Message for native tokens
+    if bid in native_tokens:
+        return [MsgExecuteContract(wallet.key.acc_address,
+                                   contract,
+                                   msg,
+                                   Coins({get_denom(bid): bid_size.whole}))]
+    # Message for CW20 tokens
+    else:
+        return [MsgExecuteContract(wallet.key.acc_address,
+                                   get_contract(bid),
+                                   ABI.send(contract, bid_size, msg))]
+
+
 class Dex:
-    __slots__ = ('dex', 'router')
+    __slots__ = ('dex', 'graph', 'router')
 
     def __init__(self, dex: str):
         self.dex = find_dex(dex)
+        self.graph = token_graph(self.dex)
         if self.dex in router:
             self.router = AccAddress(router[self.dex])
         else:
@@ -40,32 +136,83 @@ class Dex:
         """Tokens forming a trading pair with token_in
         :return: adjacency list
         """
-        return [pool.other(bid) for pool, info in pools_info.items() if bid in pool.pair and self.dex in info]
+        return self.graph.adjacent(bid)
+
+    def _distances(self, source: int, max_hops: int, avoid=-1) -> Dict[int, int]:
+        """Hop distances from token ID `source` by breadth first search up to `max_hops` not passing `avoid`
+        """
+        adjacency = self.graph.adjacency
+        distances = {source: 0}
+        layer = [source]
+        for hops in range(1, max_hops + 1):
+            next_layer = []
+            for node in layer:
+                for token in adjacency[node]:
+                    if token not in distances and token != avoid:
+                        distances[token] = hops
+                        next_layer.append(token)
+            layer = next_layer
+        return distances
 
     def dfs(
             self,
             bid: str,
-            ask: str
-    ) -> List[Tuple]:
-        """Depth first search for possible trading routes
+            ask: str,
+            max_hops=max_hops
+    ) -> Iterator[Tuple]:
+        """Depth first search for trading routes of at most `max_hops` swaps
+
+        Branches that can't reach `ask` within `max_hops` are pruned.
         """
         bid, ask = bid.lower(), ask.lower()
-        pairs = {bid: self.adjacent(bid)}
-        route = (bid,)
-        stack = [route]
-        res = []
+        graph = self.graph
+        if bid not in graph.ids or ask not in graph.ids:
+            return
+        source, target = graph.ids[bid], graph.ids[ask]
+        to_ask = self._distances(target, max_hops, source)
+        stack = [(source,)]
         while stack:
             route = stack.pop()
             node = route[-1]
-            if node == ask:
-                res.append(route)
+            if node == target:
+                yield tuple(graph.tokens[i] for i in route)
             else:
-                if node not in pairs:
-                    pairs[node] = self.adjacent(node)
-                for token in pairs[node]:
-                    if token not in route:
+                for token in graph.adjacency[node]:
+                    if token not in route and len(route) + to_ask.get(token, max_hops) <= max_hops:
                         stack.append(route + (token,))
-        return res
+
+    def edges(
+            self,
+            bid: str,
+            ask: str,
+            max_hops=max_hops
+    ) -> List[Pair]:
+        """Pairs on trading routes of at most `max_hops` swaps by layered breadth first search
+        """
+        bid, ask = bid.lower(), ask.lower()
+        graph = self.graph
+        if bid not in graph.ids or ask not in graph.ids:
+            return []
+        source, target = graph.ids[bid], graph.ids[ask]
+        from_bid = self._distances(source, max_hops, target)
+        to_ask = self._distances(target, max_hops, source)
+        unreachable = max_hops + 1
+        pairs = {}
+        for (i, j), pair in graph.pairs.items():
+            # Routes don't return to bid or leave ask.
+            if i != target and j != source and i in from_bid and j in to_ask:
+                hops = from_bid[i] + 1 + to_ask[j]
+                if hops > max_hops:
+                    continue
+                # Look one step ahead and behind for routes not bouncing back on the edge
+                if i != source and all(from_bid.get(token, unreachable) + 1 + hops - from_bid[i] > max_hops
+                                       for token in graph.adjacency[i] if token != j):
+                    continue
+                if j != target and all(to_ask.get(token, unreachable) + 1 + hops - to_ask[j] > max_hops
+                                       for token in graph.adjacency[j] if token != i):
+                    continue
+                pairs[pair] = None
+        return list(pairs)
 
     def assertion(self, bid: str, ask: str):
         bid, ask = bid.lower(), ask.lower()
@@ -75,46 +222,75 @@ class Dex:
         assert self.dex in get_dex(ask), f"{ask} not trading on {self.dex}"
         return bid, ask
 
-    def pools_from_routes(self, routes: List[Tuple]) -> Dict[Pair | str, Pool]:
+    def pools_from_pairs(self, pairs: Iterable[Pair], store=pool_store) -> Dict[Pair | str, Pool]:
         pools = {}
-        for route in routes:
-            for i in range(len(route) - 1):
-                pair = Pair(route[i], route[i + 1])
-                if pair not in pools:
-                    pools[pair] = Pool(pair, self.dex)
-                if pair == Pair('luna', 'ust'):
-                    if 'native_swap' not in pools:
-                        pools['native_swap'] = Pool('luna', 'ust', 'native_swap')
+        for pair in pairs:
+            if pair not in pools:
+                pools[pair] = store.pool(pair, self.dex)
+            if pair == Pair('luna', 'ust'):
+                if 'native_swap' not in pools:
+                    pools['native_swap'] = store.pool(pair, 'native_swap')
         return pools
 
+    def pools_from_routes(self, routes: Iterable[Tuple]) -> Dict[Pair | str, Pool]:
+        return self.pools_from_pairs(self.graph.pair(route[i], route[i + 1])
+                                     for route in routes for i in range(len(route) - 1))
+
+    @staticmethod
+    def hop(pair: Pair, pools: Dict) -> List[Pool]:
+        """Candidate pools for a swap on `pair`
+        """
+        if pair == Pair('luna', 'ust'):
+            return [pools[pair], pools['native_swap']]
+        return [pools[pair]]
+
+    def venue(self, swaps: List[Swap]) -> str:
+        """DEX of a trade
+        """
+        return self.dex
+
     @convert_params
     async def dijkstra_routing(
             self,
             bid: str,
             bid_size: Numeric,
             ask: str,
-            pools=None
+            pools=None,
+            max_hops=max_hops,
+            cache=route_cache
     ) -> Route | None:
         """Find the route with the least spread using Dijkstra's algorithm
 
+        :param cache: `RouteCache` of the pools in `pools`
         :return: Route(route, trade, swaps)
         """
         if pools is None:
             pools = {}
         bid, ask = self.assertion(bid, ask)
 
-        routes = self.dfs(bid, ask)
-        if not routes:
+        # Connected edges in the graph
+        pairs = self.edges(bid, ask, max_hops)
+        if not pairs:
             return None
 
-        graph = set()
-        for route in routes:
-            graph.update(route)
-        # Connected edges in the graph
+        edges = set(pairs)
+        graph = {token for pair in pairs for token in pair.pair}
+        to_ask = self._distances(self.graph.ids[ask], max_hops, self.graph.ids[bid])
+        to_ask = {self.graph.tokens[i]: hops for i, hops in to_ask.items()}
         if not pools:
-            pools = self.pools_from_routes(routes)
+            pools = self.pools_from_pairs(pairs)
             # Query liquidity in relevant pairs
-            await multi_pools_query(pools.values())
+            await pool_store.load(pools.values())
+        else:
+            await prefetch(pools.values())
+
+        # Same route for sizes in the bucket until a reserve changes
+        key = cache.key(self.dex, bid, bid_size, ask, max_hops)
+        routing = cache.get(key)
+        if routing is not None:
+            if routing.trade.bid_size == bid_size:
+                return routing
+            return self._evaluate(routing.route, bid_size, pools)
 
         min_vertex = Vertex(bid_size, Dec(0))
         min_vertex.route = (bid,)
@@ -131,13 +307,12 @@ class Dex:
                 break
             # Update spread of neighbors
             for neighbor in self.adjacent(next):
-                if neighbor not in visited and neighbor in graph:
-                    pair = Pair(next, neighbor)
-                    swap = await pools[pair].simulate(next, min_vertex.ask_size)
-                    if pair == Pair('luna', 'ust'):
-                        native_swap = await pools['native_swap'].simulate(next, min_vertex.ask_size)
-                        if native_swap.ask_size > swap.ask_size:
-                            swap = native_swap
+                if neighbor not in visited and neighbor in to_ask and \
+                        len(min_vertex.route) + to_ask[neighbor] <= max_hops:
+                    pair = self.graph.pair(next, neighbor)
+                    if pair not in edges:
+                        continue
+                    swap = self._best_swap(pair, next, min_vertex.ask_size, pools)
                     spread = spreads[next] + swap.spread - spreads[next] * swap.spread
                     if spread < spreads[neighbor]:
                         spreads[neighbor] = spread
@@ -146,22 +321,150 @@ class Dex:
                         vertex.swaps = min_vertex.swaps + [swap]
                         heappush(heap, vertex)
 
-        ask_size = min_vertex.swaps[-1].ask_size
+        routing = self._route(min_vertex.route, min_vertex.swaps, pools)
+        cache.put(key, routing)
+        return routing
+
+    def _best_swap(self, pair: Pair, bid: str, bid_size: Dec, pools: Dict) -> Swap:
+        """Swap on the pool returning the most
+        """
+        swap = None
+        for pool in self.hop(pair, pools):
+            simulation = pool.simulate_sync(bid, bid_size)
+            if swap is None or simulation.ask_size > swap.ask_size:
+                swap = simulation
+        return swap
+
+    def _route(self, route: Tuple, swaps: List[Swap], pools: Dict) -> Route:
+        """Wrap swaps along `route` with the spread of the whole trade
+        """
+        bid, bid_size = swaps[0].bid, swaps[0].bid_size
+        ask_size = swaps[-1].ask_size
         expected = bid_size
-        for swap in min_vertex.swaps:
-            expected *= await pools[Pair(swap.bid, swap.ask)].price(swap.bid)
+        for swap in swaps:
+            for pool in self.hop(self.graph.pair(swap.bid, swap.ask), pools):
+                if pool.dex == swap.dex:
+                    expected *= pool.price_sync(swap.bid)
         commission = expected - ask_size
         spread = commission / expected
-        swap = Swap(self.dex,
+        swap = Swap(self.venue(swaps),
                     bid,
                     bid_size,
-                    ask,
+                    route[-1],
                     ask_size,
                     spread,
                     commission)
-        return Route(route=min_vertex.route,
+        return Route(route=route,
                      trade=swap,
-                     swaps=min_vertex.swaps)
+                     swaps=swaps)
+
+    def _evaluate(self, route: Tuple, bid_size: Dec, pools: Dict) -> Route:
+        """Exact simulation of `bid_size` along `route` with the best pool of each hop
+        """
+        swaps = []
+        for i in range(len(route) - 1):
+            swap = self._best_swap(self.graph.pair(route[i], route[i + 1]), route[i], bid_size, pools)
+            swaps.append(swap)
+            bid_size = swap.ask_size
+        return self._route(route, swaps, pools)
+
+    def _float_output(self, route: Tuple, size: float, pools: Dict) -> float:
+        """Approximate output of `size` along `route` in float
+        """
+        for i in range(len(route) - 1):
+            hop = self.hop(self.graph.pair(route[i], route[i + 1]), pools)
+            size = max(pool._float_swap(route[i], size)[0] for pool in hop)
+        return size
+
+    @convert_params
+    async def k_best_routing(
+            self,
+            bid: str,
+            bid_size: Numeric,
+            ask: str,
+            k=3,
+            pools=None,
+            max_hops=max_hops
+    ) -> RouteSearch | None:
+        """Find the route with the most output for `bid_size`
+
+        Routes are ranked by float simulation at `bid_size`, then the best `k` are simulated exactly.
+
+        :return: RouteSearch(routes, elapsed) with routes from the best
+        """
+        start = perf_counter()
+        bid, ask = self.assertion(bid, ask)
+        pairs = self.edges(bid, ask, max_hops)
+        if not pairs:
+            return None
+        if not pools:
+            pools = self.pools_from_pairs(pairs)
+            await pool_store.load(pools.values())
+        else:
+            await prefetch(pools.values())
+        size = float(bid_size)
+        candidates = nlargest(k, self.dfs(bid, ask, max_hops), key=lambda route: self._float_output(route, size, pools))
+        routes = [self._evaluate(route, bid_size, pools) for route in candidates]
+        routes.sort(key=lambda route: route.trade.ask_size, reverse=True)
+        return RouteSearch(routes=routes, elapsed=perf_counter() - start)
+
+    def _spot_to(
+            self,
+            ask: str,
+            pairs: List[Pair],
+            pools: Dict[Pair | str, Pool],
+            max_hops=max_hops
+    ) -> Dict[str, float]:
+        """Best product of marginal prices from each token to `ask` in at most `max_hops` swaps
+
+        Bellman-Ford relaxation in float over the pools of `pairs`. Liquidity must have been queried.
+        """
+        spots = []
+        for pair in pairs:
+            hop = self.hop(pair, pools)
+            for token in pair.pair:
+                if token != ask:
+                    spots.append((token, pair.other(token), max(pool._float_swap(token, 0.)[1] for pool in hop)))
+        best = {ask: 1.}
+        for _ in range(max_hops):
+            relaxed = dict(best)
+            for token, other, spot in spots:
+                if other in best and spot * best[other] > relaxed.get(token, 0.):
+                    relaxed[token] = spot * best[other]
+            best = relaxed
+        return best
+
+    async def size_for_price(
+            self,
+            bid: str,
+            ask: str,
+            price: Numeric,
+            pools=None,
+            max_hops=max_hops
+    ) -> Dec:
+        """Upper bound of the largest bid size filled at an average price of at least `price` on any route
+
+        `price` is in ask per bid of the smallest units.
+        Swaps after the first are bounded by their marginal prices, so the bound is exact for direct pools
+        and takes one pass over the pools of `edges`.
+        """
+        bid, ask = self.assertion(bid, ask)
+        pairs = self.edges(bid, ask, max_hops)
+        if not pairs:
+            return Dec(0)
+        if not pools:
+            pools = self.pools_from_pairs(pairs)
+            await pool_store.load(pools.values())
+        else:
+            await prefetch(pools.values())
+        price = float(price)
+        spots = self._spot_to(ask, pairs, pools, max_hops - 1)
+        size = 0.
+        for pair in pairs:
+            if bid in pair.pair and pair.other(bid) in spots:
+                for pool in self.hop(pair, pools):
+                    size = max(size, pool._size_for_price(bid, price / spots[pair.other(bid)]))
+        return Dec(size)
 
     async def route_to_msg(
             self,
@@ -187,28 +490,7 @@ class Dex:
                         return await self.swap_msg(bid, bid_size, ask)
             if len(swaps) == 1:
                 return await Pool(trade).swap_to_msg(trade, minimum_receive)
-            operations = []
-            for swap in swaps:
-                if swap.dex == 'native_swap':
-                    operation = ABI.native_swap(swap.bid, swap.ask)
-                else:
-                    operation = ABI.dex_swap(swap.dex, swap.bid, swap.ask)
-                operations.append(operation)
-            msg = ABI.execute_swap_operations(bid_size,
-                                              minimum_receive,
-                                              f'{max_spread}',
-                                              operations)
-            # Message for native tokens
-            if bid in native_tokens:
-                return [MsgExecuteContract(wallet.key.acc_address,
-                                           self.router,
-                                           msg,
-                                           Coins({get_denom(bid): bid_size.whole}))]
-            # Message for CW20 tokens
-            else:
-                return [MsgExecuteContract(wallet.key.acc_address,
-                                           get_contract(bid),
-                                           ABI.send(self.router, bid_size, msg))]
+            return router_msg(self.router, swaps, minimum_receive)
         # Loop doesn't have a router.
         else:
             msgs = []
@@ -239,8 +521,7 @@ class Dex:
             minimum_receive = Dec(execute_msg['execute_swap_operations']['minimum_receive'])
         else:
             minimum_receive = Dec(0)
-        pools = []
-        swaps = []
+        hops = []
         for operation in operations:
             for dex in operation:
                 break
@@ -253,18 +534,210 @@ class Dex:
                 native_swap = operation['native_swap']
                 bid = from_denom(native_swap['offer_denom'])
                 ask = from_denom(native_swap['ask_denom'])
-            if bid and ask:
-                if (Pair(bid, ask), dex) in pool_map:
-                    pool = pool_map[Pair(bid, ask), dex]
-                    pools.append(pool)
-                    swap = await pool.simulate(bid, ask_size)
-                    swaps.append(swap)
-                    ask_size = swap.ask_size
+            if bid and ask and (Pair(bid, ask), dex) in pool_map:
+                hops.append((bid, pool_map[Pair(bid, ask), dex]))
+            else:
+                return False
+        await prefetch(pool for _, pool in hops)
+        swaps = []
+        for bid, pool in hops:
+            swap = pool.simulate_sync(bid, ask_size)
+            swaps.append(swap)
+            ask_size = swap.ask_size
+        if ask_size > minimum_receive:
+            for (_, pool), swap in zip(hops, swaps):
+                await pool.simulate_msg(swap)
+            return True
+        return False
+
+
+class MultiDex(Dex):
+    """Routing across all DEXes
+
+    Each hop takes the best pool among DEXes listing the pair.
+    """
+    __slots__ = ()
+
+    def __init__(self):
+        self.dex = ''
+        self.graph = token_graph('')
+        self.router = AccAddress('')
+
+    def assertion(self, bid: str, ask: str):
+        bid, ask = bid.lower(), ask.lower()
+        assert bid in tokens_info, f"No token info {bid}"
+        assert bid in self.graph.ids, f"{bid} not trading on any DEX"
+        assert ask in tokens_info, f"No token info {ask}"
+        assert ask in self.graph.ids, f"{ask} not trading on any DEX"
+        return bid, ask
+
+    def pools_from_pairs(self, pairs: Iterable[Pair], store=pool_store) -> Dict[Tuple[Pair, str], Pool]:
+        pools = {}
+        for pair in pairs:
+            for dex in registry.dexes_of(pair):
+                if (pair, dex) not in pools:
+                    pools[pair, dex] = store.pool(pair, dex)
+        return pools
+
+    @staticmethod
+    def hop(pair: Pair, pools: Dict) -> List[Pool]:
+        """Candidate pools for a swap on `pair`
+        """
+        return [pools[pair, dex] for dex in registry.dexes_of(pair) if (pair, dex) in pools]
+
+    def venue(self, swaps: List[Swap]) -> str:
+        """DEXes of a trade
+        """
+        return '+'.join(dict.fromkeys(swap.dex for swap in swaps))
+
+    @staticmethod
+    def segments(swaps: List[Swap]) -> List[Tuple[str, List[Swap]]]:
+        """Split swaps into consecutive runs executable by one router
+
+        A router executes swaps on its own DEX and native swaps.
+        """
+        segments = []
+        for swap in swaps:
+            if segments:
+                dex, segment = segments[-1]
+                if dex in router and swap.dex in (dex, 'native_swap'):
+                    segment.append(swap)
+                    continue
+                if dex == 'native_swap' and len(segment) == 1 and swap.dex in router:
+                    segment.append(swap)
+                    segments[-1] = swap.dex, segment
                     continue
-            break
+            segments.append((swap.dex, [swap]))
+        return segments
+
+    async def route_to_msg(
+            self,
+            routing: Route,
+            minimum_receive=Dec(0)
+    ) -> List[Msg]:
+        """Wrap trading route to messages, one per router or pool
+
+        Messages are executed atomically in a transaction, so a shortfall in any segment reverts the trade.
+        """
+        if routing is None:
+            print('Impossible swap.')
+            raise ValueError
+        trade, swaps = routing.trade, routing.swaps
+        if minimum_receive == Dec(0):
+            minimum_receive = trade.ask_size * (1 - slippage)
+            # Cycles must not lose
+            if trade.bid == trade.ask:
+                minimum_receive = max(minimum_receive, trade.bid_size)
+        segments = self.segments(swaps)
+        msgs = []
+        for i, (dex, segment) in enumerate(segments):
+            if i == len(segments) - 1:
+                receive = minimum_receive
+            else:
+                receive = segment[-1].ask_size * (1 - slippage)
+            if len(segment) == 1:
+                msgs.extend(await Pool(segment[0]).swap_to_msg(segment[0], receive))
+            else:
+                msgs.extend(router_msg(AccAddress(router[dex]), segment, receive))
+        return msgs
+
+
+# Account addresses, or the first 44 characters of contract addresses
+address_pattern = re.compile(rb'terra1[02-9ac-hj-np-z]{38}')
+msg_swap_type_url = b'/terra.market.v1beta1.MsgSwap'
+
+
+class SwapFilter:
+    """Selection of block messages trading on tracked pools and routers
+
+    Raw transactions are scanned for contracts of `pool_contract_map`, `token_contract_map`
+    and `router`, or market swaps, and only those found are decoded.
+    """
+    __slots__ = ('market', 'routers', 'dexes', 'addresses', 'size', 'scanned', 'matched')
+
+    def __init__(self, market=True):
+        self.market = market
+        self.routers = {AccAddress(address): dex for dex, address in router.items()}
+        self.dexes: Dict[str, Dex] = {}
+        self.scanned = self.matched = 0
+        self.refresh()
+
+    def __repr__(self):
+        return f"SwapFilter({len(self.addresses)} contracts, scanned={self.scanned}, skipped={self.skipped:.2%})"
+
+    def refresh(self):
+        """Track contracts registered since the last refresh
+        """
+        self.addresses = {address.encode() for address in chain(pool_contract_map, token_contract_map, self.routers)}
+        self.size = len(pool_contract_map) + len(token_contract_map)
+
+    @property
+    def skipped(self) -> float:
+        """Fraction of scanned transactions not decoded
+        """
+        return 1 - self.matched / self.scanned if self.scanned else 0.
+
+    def __call__(self, tx: bytes) -> bool:
+        self.scanned += 1
+        addresses = self.addresses
+        for match in address_pattern.finditer(tx):
+            start = match.start()
+            if match.group() in addresses or tx[start:start + 64] in addresses:
+                break
         else:
-            if ask_size > minimum_receive:
-                for pool, swap in zip(pools, swaps):
-                    await pool.simulate_msg(swap)
-                return True
-        return False
+            if not (self.market and msg_swap_type_url in tx):
+                return False
+        self.matched += 1
+        return True
+
+    def dex(self, contract: str) -> Dex:
+        dex = self.routers[contract]
+        if dex not in self.dexes:
+            self.dexes[dex] = Dex(dex)
+        return self.dexes[dex]
+
+    @staticmethod
+    def swap_operations(execute_msg: Dict, offer_amount) -> Dict | None:
+        """`execute_swap_operations` message with its offer amount for `Dex.simulate_msg`
+        """
+        if msg_validator.validate(execute_msg, schema=swap_operations_schema):
+            operations = dict(execute_msg['execute_swap_operations'], offer_amount=str(offer_amount))
+            return {'execute_swap_operations': operations}
+
+    def records(self, tx: Tx) -> Iterator[SwapMsg]:
+        """Messages of `tx` on tracked pools and routers
+        """
+        for msg in tx.body.messages:
+            if isinstance(msg, MsgSwap):
+                pair = Pair(from_denom(msg.offer_coin.denom), from_denom(msg.ask_denom))
+                if self.market and registry.has(pair, 'native_swap'):
+                    yield SwapMsg(pool_store.pool(pair, 'native_swap'), msg)
+            elif isinstance(msg, MsgExecuteContract) and isinstance(msg.execute_msg, dict):
+                contract, execute_msg = msg.contract, msg.execute_msg
+                if contract in pool_contract_map:
+                    yield SwapMsg(pool_contract_map[contract], msg)
+                elif contract in self.routers:
+                    coins = msg.coins.to_list()
+                    operations = self.swap_operations(execute_msg, coins[0].amount) if coins else None
+                    if operations:
+                        yield SwapMsg(self.dex(contract), operations)
+                elif contract in token_contract_map and msg_validator.validate(execute_msg, schema=send_schema):
+                    send = execute_msg['send']
+                    if send['contract'] in pool_contract_map:
+                        yield SwapMsg(pool_contract_map[send['contract']], msg)
+                    elif send['contract'] in self.routers:
+                        operations = self.swap_operations(base64str_decode(send['msg']), send['amount'])
+                        if operations:
+                            yield SwapMsg(self.dex(send['contract']), operations)
+
+    async def stream(self, blockchain: BlockChain) -> AsyncIterator[SwapMsg]:
+        """Messages of the block of `blockchain` on tracked pools and routers, in order
+        """
+        if self.size != len(pool_contract_map) + len(token_contract_map):
+            self.refresh()
+        async for tx in blockchain.stream(self):
+            for record in self.records(tx):
+                yield record
+
+    def reset(self):
+        self.scanned = self.matched = 0
@@ -1,3 +1,5 @@
+from src.reserves import *
+from src.archive import *
 from src.dex import *
 from src.transaction import *
 import attr
@@ -76,8 +78,8 @@ class LimitOrder(Swap):
         ins.tx = TxResult.from_data(data['tx']) if data['tx'] else None
         return ins
 
-    async def match(self, pools: Dict[Pair | str, Pool]) -> Route | None:
-        route = await Dex(self.dex).dijkstra_routing(self.bid, self.bid_size, self.ask, pools)
+    async def match(self, pools: Dict[Pair | str, Pool], cache=route_cache) -> Route | None:
+        route = await Dex(self.dex).dijkstra_routing(self.bid, self.bid_size, self.ask, pools, cache=cache)
         if route.trade.ask_size > self.ask_size:
             self.triggered = True
             return route
@@ -93,21 +95,23 @@ class StopLoss(LimitOrder):
             f"Trigger price {self.price.to_short_str()} {self.ask} per {self.bid}"
         return 'Open ' + s if self.status == 'open' else 'Filled ' + s
 
-    async def match(self, pools: Dict[Pair | str, Pool]) -> Route | None:
+    async def match(self, pools: Dict[Pair | str, Pool], cache=route_cache) -> Route | None:
         dex = Dex(self.dex)
+        await prefetch(pools.values())
         for route in dex.dfs(self.bid, self.ask):
             price = Dec(1)
             for i in range(len(route) - 1):
-                pair = Pair(route[i], route[i + 1])
+                pair = dex.graph.pair(route[i], route[i + 1])
                 if pair == Pair('luna', 'ust'):
                     pool = pools['native_swap']
                 else:
                     pool = pools[pair]
-                price *= await pool.price(route[i])
+                price *= pool.price_sync(route[i])
             if price < self.price:
                 self.triggered = True
+                break
         if self.triggered:
-            route = await dex.dijkstra_routing(self.bid, self.bid_size, self.ask, pools)
+            route = await dex.dijkstra_routing(self.bid, self.bid_size, self.ask, pools, cache=cache)
             self.ask_size = route.trade.ask_size * (1 - slippage)
             return route
         return None
@@ -139,10 +143,10 @@ class ConditionOrder:
         if order_id in self.condition:
             self.condition[order_id] = True
 
-    async def match(self, pools: Dict[Pair | str, Pool]) -> Route | None:
+    async def match(self, pools: Dict[Pair | str, Pool], cache=route_cache) -> Route | None:
         if all(self.condition.values()):
             self.order.triggered = True
-            return await self.order.match(pools)
+            return await self.order.match(pools, cache)
 
 
 @attr.s(slots=True)
@@ -152,6 +156,13 @@ class OrderBook:
     filled: Dict[str, LimitOrder] = attr.ib(factory=dict)
     pools: Dict[Pair | str, Pool] = attr.ib(factory=dict)
     flag = attr.ib(default=False)
+    # Record of pool states per block
+    archive: SnapshotArchive | None = attr.ib(default=None)
+    # Pool instances of the orders
+    store: PoolStateStore = attr.ib(default=pool_store)
+    # Reserve updates of `store`
+    sync: ReserveSync = attr.ib(default=attr.Factory(
+        lambda self: reserve_sync if self.store is pool_store else ReserveSync(self.store), takes_self=True))
 
     def submit(self, order: LimitOrder):
         order.dex = self.dex.dex
@@ -162,18 +173,20 @@ class OrderBook:
                     break
         self.open[order.id] = order
         print(order)
-        self.pools.update(self.dex.pools_from_routes(self.dex.dfs(order.bid, order.ask)))
+        pools = self.dex.pools_from_pairs(self.dex.edges(order.bid, order.ask), self.store)
+        self.store.subscribe(pool for key, pool in pools.items() if key not in self.pools)
+        self.pools.update(pools)
 
     def cancel(self, order_id: str):
         if order_id in self.open:
             self.open.pop(order_id)
         pools = {}
         for order in self.open.values():
-            pools.update(self.dex.pools_from_routes(self.dex.dfs(order.bid, order.ask)))
+            pools.update(self.dex.pools_from_pairs(self.dex.edges(order.bid, order.ask), self.store))
         keys = set(self.pools.keys())
         for key in keys:
             if key not in pools:
-                self.pools.pop(key)
+                self.store.unsubscribe((self.pools.pop(key),))
 
     async def fill(self, order: LimitOrder, route: Route):
         try:
@@ -303,10 +316,12 @@ q   Quit""")
         open_db.deleteAll()
         if broker:
             asyncio.create_task(self.broker())
-        async for _ in wallet.blockchain:
+        async for block in wallet.blockchain:
             if self.flag:
                 break
-            await multi_pools_query(self.pools.values())
+            await self.sync.update(wallet.blockchain.block_height)
+            if self.archive:
+                self.archive.record(block, self.store.subscribers)
             tasks = [asyncio.create_task(order.match(self.pools)) for order in self.open.values()]
             await asyncio.gather(*tasks)
             routes: List[Route] = [task.result() for task in tasks]
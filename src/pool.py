@@ -1,7 +1,19 @@
 from math import sqrt
 from functools import singledispatch
+from collections.abc import Mapping
 from src.terra import *
+from src.amm import *
 import attr
+import numpy as np
+
+# Offer amount probing the marginal price of stable pools
+price_probe = 10 ** 6
+# Memoized stable swap invariants
+invariant_stats = CacheStats()
+# Bound of Newton's iterations in depth queries
+depth_iterations = 32
+# Shared to compare liquidity without constructing `Dec`
+dec_zero = Dec(0)
 
 
 def quadratic_root(a: float, b: float, c: float):
@@ -38,35 +50,42 @@ class Swap:
                f"Spread {float(self.spread):.3%} Commission {self.float_commission()} {self.ask}"
 
 
-class Pool:
-    """Class representing an AMM liquidity pool
+@singledispatch
+def pool_key(*args) -> Tuple[Pair, str]:
+    """Pair and DEX of `Pool` arguments
     """
-    __slots__ = ('amp', 'amount1', 'amount2', 'contract', 'dex', 'fee', 'pair', 'stable',
-                 'token1', 'token2', 'tx_fee', 'params', 'recovered')
+    raise TypeError(*args)
 
-    def __init__(self, *args):
-        @singledispatch
-        def init(*args):
-            raise TypeError(*args)
 
-        @init.register(str)
-        def _(token1: str, token2: str, dex=''):
-            return Pair(token1, token2), find_dex(dex)
+@pool_key.register(str)
+def _(token1: str, token2: str, dex=''):
+    return Pair(token1, token2), find_dex(dex)
 
-        @init.register(Pair)
-        def _(pair, dex=''):
-            return pair, find_dex(dex)
 
-        @init.register(Swap)
-        def _(swap):
-            return Pair(swap.bid, swap.ask), swap.dex
+@pool_key.register(Pair)
+def _(pair, dex=''):
+    return pair, find_dex(dex)
 
-        self.pair, self.dex = init(*args)
+
+@pool_key.register(Swap)
+def _(swap):
+    return Pair(swap.bid, swap.ask), swap.dex
+
+
+class Pool:
+    """Class representing an AMM liquidity pool
+    """
+    __slots__ = ('amp', 'amount1', 'amount2', 'contract', 'dex', 'fee', 'pair', 'stable',
+                 'token1', 'token2', 'tx_fee', 'params', 'recovered', '_invariants')
+
+    def __init__(self, *args):
+        self.pair, self.dex = pool_key(*args)
         self.token1, self.token2 = self.pair.pair
         assert self.token1 != self.token2
         assert self.token1 in tokens_info, f"No token info {self.token1}"
         assert self.token2 in tokens_info, f"No token info {self.token2}"
         self.amp = self.amount1 = self.amount2 = Dec(0)
+        self._invariants: Dict[str, int] = {}
         # Terra Market module swap
         if self.dex == 'native_swap':
             self.params = {'luna_ust': Dec(0)}
@@ -74,10 +93,7 @@ class Pool:
             self.recovered = False
         else:
             try:
-                self.contract = AccAddress(pools_info[self.pair][self.dex]['contract'])
-                self.fee = pools_info[self.pair][self.dex]['fee']
-                self.tx_fee = pools_info[self.pair][self.dex]['tx_fee']
-                self.stable = pools_info[self.pair][self.dex]['stable']
+                self.contract, self.fee, self.tx_fee, self.stable = registry.pool_info(self.pair, self.dex)
             except KeyError:
                 self.pair_info(self.dex)
 
@@ -94,16 +110,13 @@ class Pool:
         """Find pair info from smart contract
         """
         assert dex != 'native_swap'
-        if self.pair in pools_info:
+        dexes = [dex for dex in registry.dexes_of(self.pair) if dex != 'native_swap']
+        if dexes:
             # dex isn't specified.
-            for dex, info in pools_info[self.pair].items():
-                print(f'Using {dex}')
-                self.dex = dex
-                self.contract = AccAddress(info['contract'])
-                self.fee = info['fee']
-                self.tx_fee = info['tx_fee']
-                self.stable = info['stable']
-                return
+            print(f'Using {dexes[0]}')
+            self.dex = dexes[0]
+            self.contract, self.fee, self.tx_fee, self.stable = registry.pool_info(self.pair, self.dex)
+            return
         else:
             print(f"Can't find {self.pair} info locally. Querying blockchain.")
             from terra_sdk.client.lcd import LCDClient
@@ -136,6 +149,8 @@ class Pool:
             if 'pair_type' in asset_infos and 'stable' in asset_infos['pair_type']:
                 self.fee = 0.0005
                 self.stable = True
+            register_pool(self.pair, self.dex, {'contract': asset_infos['contract_addr'],
+                                                'fee': self.fee, 'tx_fee': self.tx_fee, 'stable': self.stable})
 
     @staticmethod
     def _token_amount(
@@ -167,9 +182,7 @@ class Pool:
             self.params['luna_ust'] = rates.get('uusd').amount
             self.params['sdt_ust'] = self.params['luna_ust'] / self.params['luna_sdt']
             self.params['delta'] = delta
-            self.amount1 = self.params['base_pool'] * self.params['base_pool'] / (
-                    self.params['base_pool'] + self.params['delta']) / self.params['luna_sdt']
-            self.amount2 = (self.params['base_pool'] + self.params['delta']) * self.params['sdt_ust']
+            self._market_pools()
             self.recovered = False
         else:
             if self.stable:
@@ -179,6 +192,7 @@ class Pool:
                 pool = await terra.wasm.contract_query(self.contract, ABI.self('pool'))
             self.amount1 = self._token_amount(pool['assets'], self.token1)
             self.amount2 = self._token_amount(pool['assets'], self.token2)
+            self._invalidate()
 
     async def simulate_msg(self, msg: Msg | Swap) -> bool:
         """Simulate mempool messages
@@ -213,9 +227,7 @@ class Pool:
                 if not self.recovered:
                     self.recovered = True
                     self.params['delta'] *= 1 - 1 / self.params['pool_recovery_period']
-                    self.amount1 = self.params['base_pool'] * self.params['base_pool'] / (
-                            self.params['base_pool'] + self.params['delta']) / self.params['luna_sdt']
-                    self.amount2 = (self.params['base_pool'] + self.params['delta']) * self.params['sdt_ust']
+                    self._market_pools()
                 coin = msg.offer_coin
                 bid = from_denom(coin.denom)
                 bid_size = Dec(coin.amount)
@@ -233,17 +245,53 @@ class Pool:
             raise TypeError
         if bid_size != Dec(0):
             if swap.ask_size >= minimum_receive:
-                if self.token1 == bid:
+                if self.dex == 'native_swap':
+                    # Terra pool delta in SDR is updated before the spread is charged.
+                    if bid == 'ust':
+                        self.params['delta'] += swap.bid_size / self.params['sdt_ust']
+                    else:
+                        self.params['delta'] -= (swap.ask_size + swap.commission) / self.params['sdt_ust']
+                    self._market_pools()
+                elif self.token1 == bid:
                     self.amount1 += swap.bid_size
                     self.amount2 -= swap.ask_size
+                    self._invalidate()
                 elif self.token2 == bid:
                     self.amount2 += swap.bid_size
                     self.amount1 -= swap.ask_size
+                    self._invalidate()
                 else:
                     raise ValueError
                 return True
         return False
 
+    def _market_pools(self):
+        """Virtual Luna and UST pools of the market module
+        """
+        base_pool, delta = self.params['base_pool'], self.params['delta']
+        self.amount1 = base_pool * base_pool / (base_pool + delta) / self.params['luna_sdt']
+        self.amount2 = (base_pool + delta) * self.params['sdt_ust']
+        self._invalidate()
+
+    def _invalidate(self):
+        """Drop values derived from liquidity
+        """
+        self._invariants.clear()
+        pool_states.update(self)
+
+    def _invariant(self, bid: str) -> int:
+        """Stable swap invariant D memoized per pool state
+        """
+        try:
+            d = self._invariants[bid]
+            invariant_stats.hits += 1
+        except KeyError:
+            invariant_stats.misses += 1
+            # Offer pool first as the contract
+            offer_pool, ask_pool = self._xy(bid)
+            d = self._invariants[bid] = compute_d(int(self.amp) * N_COINS, int(offer_pool), int(ask_pool))
+        return d
+
     def multicall_query_msg(self) -> List[ABI.multicall_query]:
         """Query message
         """
@@ -264,26 +312,24 @@ class Pool:
                 self.amount2 = self._token_amount(data['assets'], self.token2)
             elif 'params' in data:
                 self.amp = Dec(base64str_decode(data['params'])['amp'])
+        self._invalidate()
+
+    def _xy(self, token_in: str) -> (Dec, Dec):
+        """Liquidity without querying
+        """
+        if token_in == self.token1:
+            return self.amount1, self.amount2
+        elif token_in == self.token2:
+            return self.amount2, self.amount1
+        else:
+            raise ValueError
 
     async def xy(self, token_in: str) -> (Dec, Dec):
         """Initial liquidity
         """
         if self.amount1 == Dec(0) or self.amount2 == Dec(0):
             await self.query()
-        if self.dex == 'native_swap':
-            if token_in == 'luna':
-                return self.amount1, self.amount2
-            elif token_in == 'ust':
-                return self.amount2, self.amount1
-            else:
-                raise ValueError
-        else:
-            if token_in == self.token1:
-                return self.amount1, self.amount2
-            elif token_in == self.token2:
-                return self.amount2, self.amount1
-            else:
-                raise ValueError
+        return self._xy(token_in)
 
     @convert_params
     async def _constant_product_swap(
@@ -331,16 +377,61 @@ class Pool:
     async def price(self, bid: str) -> Dec:
         """Marginal price of token_in in token_out
         """
-        xi, yi = await self.xy(bid)
+        await self.xy(bid)
+        return self.price_sync(bid)
+
+    def price_sync(self, bid: str) -> Dec:
+        """Marginal price on queried liquidity
+        """
+        xi, yi = self._xy(bid)
         if self.dex == 'native_swap':
             return self.params['luna_ust'] if bid == 'luna' else self.params['luna_ust'].__rtruediv__(1)
         else:
             if self.stable:
-                bid_size = Dec(10 ** 6)
-                return await self._stable_swap(bid, bid_size) / bid_size
+                probe, _, _ = stable_swap(int(xi), int(yi), price_probe, int(self.amp), 0, self._invariant(bid))
+                return Dec(probe) / price_probe
             else:
                 return yi / xi
 
+    def _compute_swap(
+            self,
+            bid: str,
+            offer_amount: int,
+            offer_pool: int,
+            ask_pool: int
+    ) -> (int, int, int):
+        """Swap in the integer math of the contracts
+
+        :return: (ask_size, spread, commission) where spread is a decimal
+        """
+        if self.dex == 'native_swap':
+            luna_ust = to_decimal(self.params['luna_ust'])
+            if bid == 'luna':
+                offer_rate, ask_rate = DECIMAL_FRACTIONAL, luna_ust
+            else:
+                offer_rate, ask_rate = luna_ust, DECIMAL_FRACTIONAL
+            return market_swap(offer_amount,
+                               bid == 'luna',
+                               offer_rate,
+                               ask_rate,
+                               to_decimal(self.params['luna_sdt']),
+                               to_decimal(self.params['base_pool']),
+                               to_decimal(self.params['delta']),
+                               to_decimal(self.fee))
+        commission_rate = to_decimal(self.fee)
+        if self.stable:
+            amp, d = int(self.amp), self._invariant(bid)
+            ask_size, _, commission = stable_swap(offer_pool, ask_pool, offer_amount, amp, commission_rate, d)
+            # Marginal price before commission
+            probe, _, _ = stable_swap(offer_pool, ask_pool, price_probe, amp, 0, d)
+            expected = offer_amount * probe
+            spread = from_ratio(expected - ask_size * price_probe, expected)
+        else:
+            ask_size, _, commission = constant_product_swap(offer_pool, ask_pool, offer_amount, commission_rate)
+            expected = offer_amount * ask_pool
+            spread = from_ratio(expected - ask_size * offer_pool, expected)
+        return ask_size, spread, commission
+
     @convert_params
     async def simulate(
             self,
@@ -348,6 +439,183 @@ class Pool:
             bid_size: Numeric
     ) -> Swap:
         """Simulate the swap locally
+
+        Liquidity is queried only if it's missing, and the swap is then simulated synchronously.
+        """
+        if self.amount1 == dec_zero or self.amount2 == dec_zero:
+            await self.query()
+        return self._simulate(bid, bid_size)
+
+    @convert_params
+    def simulate_sync(
+            self,
+            bid: str,
+            bid_size: Numeric
+    ) -> Swap:
+        """Simulate the swap on queried liquidity
+        """
+        return self._simulate(bid, bid_size)
+
+    def _simulate(self, bid: str, bid_size: Dec) -> Swap:
+        xi, yi = self._xy(bid)
+        ask_size, spread, commission = self._compute_swap(bid, int(bid_size), int(xi), int(yi))
+        return Swap(self.dex,
+                    bid,
+                    bid_size,
+                    self.pair.other(bid),
+                    ask_size,
+                    Dec.with_prec(spread, DECIMAL_PLACES),
+                    commission)
+
+    def simulate_many(
+            self,
+            bid: str,
+            sizes: np.ndarray
+    ) -> (np.ndarray, np.ndarray, np.ndarray):
+        """Simulate swaps of many sizes in one vectorized pass
+
+        Sizes are in the smallest unit like `Swap.bid_size`. Liquidity must have been queried.
+
+        :return: (ask_sizes, spreads, commissions)
+        """
+        bid = bid.lower()
+        assert self.amount1 != Dec(0) and self.amount2 != Dec(0), f"{self} hasn't been queried"
+        sizes = np.asarray(sizes, dtype=np.float64)
+        if self.dex == 'native_swap':
+            luna_sdt, luna_ust = float(self.params['luna_sdt']), float(self.params['luna_ust'])
+            base_pool, delta = float(self.params['base_pool']), float(self.params['delta'])
+            cp = base_pool * base_pool
+            terra_pool = base_pool + delta
+            luna_pool = cp / terra_pool
+            if bid == 'luna':
+                offer_pool, ask_pool = luna_pool, terra_pool
+                base_offer = sizes * luna_sdt
+                expected = sizes * luna_ust
+            else:
+                offer_pool, ask_pool = terra_pool, luna_pool
+                base_offer = sizes * luna_sdt / luna_ust
+                expected = base_offer / luna_sdt
+            ask_base = ask_pool - cp / (offer_pool + base_offer)
+            # The minimum spread charged on Terra<>Luna swaps
+            spreads = np.maximum((base_offer - ask_base) / base_offer, float(self.fee))
+            commissions = expected * spreads
+            return expected - commissions, spreads, commissions
+        xi, yi = (float(amount) for amount in self._xy(bid))
+        if self.stable:
+            amp, d = int(self.amp), self._invariant(bid)
+            probe, _, _ = stable_swap(int(xi), int(yi), price_probe, amp, 0, d)
+            expected = sizes * probe / price_probe
+            # y^2 + (x + D / 2A - D) y - D^3 / 8Ax = 0
+            leverage, d = amp * N_COINS, float(d)
+            xf = xi + sizes
+            b = xf + d / leverage - d
+            c = d * d * d / (4 * leverage * xf)
+            returns = yi - (np.sqrt(b * b + 4 * c) - b) / 2
+        else:
+            expected = sizes * yi / xi
+            returns = sizes * yi / (xi + sizes)
+        commissions = returns * self.fee
+        ask_sizes = returns - commissions
+        return ask_sizes, (expected - ask_sizes) / expected, commissions
+
+    def _market_float(self, bid: str) -> (float, float, float, float):
+        """Market module in float
+
+        :return: (rate, offer_pool, ask_pool, base) where base converts bid to SDR
+        """
+        luna_sdt, luna_ust = float(self.params['luna_sdt']), float(self.params['luna_ust'])
+        base_pool, delta = float(self.params['base_pool']), float(self.params['delta'])
+        terra_pool = base_pool + delta
+        luna_pool = base_pool * base_pool / terra_pool
+        if bid == 'luna':
+            return luna_ust, luna_pool, terra_pool, luna_sdt
+        else:
+            return 1 / luna_ust, terra_pool, luna_pool, luna_sdt / luna_ust
+
+    def _float_swap(self, bid: str, size: float) -> (float, float):
+        """Receive amount and marginal price after swapping `size` in float
+
+        Liquidity must have been queried.
+        """
+        if self.dex == 'native_swap':
+            rate, offer_pool, ask_pool, base = self._market_float(bid)
+            # 1 - spread
+            factor = ask_pool / (offer_pool + base * size)
+            if factor >= 1 - float(self.fee):
+                # The minimum spread
+                return rate * (1 - float(self.fee)) * size, rate * (1 - float(self.fee))
+            return rate * factor * size, rate * factor * offer_pool / (offer_pool + base * size)
+        xi, yi = (float(amount) for amount in self._xy(bid))
+        net = 1 - self.fee
+        if self.stable:
+            d, leverage = float(self._invariant(bid)), int(self.amp) * N_COINS
+            # y^2 + b y - c = 0
+            xf = xi + size
+            b = xf + d / leverage - d
+            c = d * d * d / (4 * leverage * xf)
+            y = (sqrt(b * b + 4 * c) - b) / 2
+            # dy/dx = -(y + c / x) / (2y + b)
+            return net * (yi - y), net * (y + c / xf) / (2 * y + b)
+        return net * yi * size / (xi + size), net * yi * xi / (xi + size) ** 2
+
+    @convert_params
+    async def price_after(
+            self,
+            bid: str,
+            bid_size: Numeric
+    ) -> Dec:
+        """Marginal price net of commission after swapping `bid_size`
+        """
+        await self.xy(bid)
+        return Dec(self._float_swap(bid, float(bid_size))[1])
+
+    def _size_for_price(self, bid: str, price: float) -> float:
+        """Largest size with average price above `price` in float
+
+        Liquidity must have been queried.
+        """
+        if self.dex == 'native_swap':
+            rate, offer_pool, ask_pool, base = self._market_float(bid)
+            if rate * (1 - float(self.fee)) < price:
+                return 0.
+            # rate * ask_pool / (offer_pool + base * size) >= price
+            return max((rate * ask_pool / price - offer_pool) / base, 0.)
+        xi, yi = (float(amount) for amount in self._xy(bid))
+        net = 1 - self.fee
+        if self.stable:
+            # g(size) = receive - price * size is concave and g(0) = 0.
+            if self._float_swap(bid, 0.)[1] <= price:
+                return 0.
+            # Newton's method from the right of the root converges monotonically.
+            size = net * yi / price
+            for _ in range(depth_iterations):
+                receive, marginal = self._float_swap(bid, size)
+                step = (receive - price * size) / (marginal - price)
+                size -= step
+                if abs(step) < 1:
+                    break
+            return max(size, 0.)
+        # net * yi / (xi + size) >= price
+        return max(net * yi / price - xi, 0.)
+
+    async def size_for_price(self, bid: str, price: Numeric) -> Dec:
+        """Largest bid size filled at an average price of at least `price`
+
+        `price` is in ask per bid of the smallest units.
+        """
+        bid = bid.lower()
+        await self.xy(bid)
+        return Dec(self._size_for_price(bid, float(price)))
+
+    @convert_params
+    async def simulate_dec(
+            self,
+            bid: str,
+            bid_size: Numeric
+    ) -> Swap:
+        """Simulate the swap locally in `Dec`
+
+        Reference for the integer math of `simulate`.
         """
         ask = self.pair.other(bid)
         expected = await self.price(bid) * bid_size
@@ -396,13 +664,16 @@ class Pool:
                 expected = await self.price(bid) * bid_size
             commission = expected - ask_size
         else:
+            xi, yi = await self.xy(bid)
             # Stable swap
             if self.stable:
-                bid_size = - await self._stable_swap(ask, - expected)
+                bid_size, _, commission = stable_reverse_swap(int(xi), int(yi), int(ask_size), int(self.amp),
+                                                              to_decimal(self.fee), self._invariant(bid))
             # Constant product swap
             else:
-                bid_size = - await self._constant_product_swap(ask, - expected)
-            commission = expected * self.fee
+                bid_size, _, commission = constant_product_reverse_swap(int(xi), int(yi), int(ask_size),
+                                                                        to_decimal(self.fee))
+            bid_size, commission = Dec(bid_size), Dec(commission)
             expected = await self.price(bid) * bid_size
         spread = (expected - ask_size) / expected
         return Swap(self.dex,
@@ -469,6 +740,30 @@ class Pool:
         return await self.swap_to_msg(swap, minimum_receive)
 
 
+class PoolStates:
+    """Version of pool states, bumped when a reserve changes
+    """
+    __slots__ = ('reserves', 'version')
+
+    def __init__(self):
+        self.reserves: Dict[Pool, Tuple[Dec, Dec, Dec]] = {}
+        self.version = 0
+
+    def __repr__(self):
+        return f"PoolStates(version={self.version}, pools={len(self.reserves)})"
+
+    def update(self, pool: Pool):
+        """Record reserves of `pool`
+        """
+        reserves = pool.amount1, pool.amount2, pool.amp
+        if self.reserves.get(pool) != reserves:
+            self.reserves[pool] = reserves
+            self.version += 1
+
+
+pool_states = PoolStates()
+
+
 async def multi_pools_query(pools: Iterable[Pool]):
     """Query multiple pools
     """
@@ -495,9 +790,98 @@ async def multi_pools_query(pools: Iterable[Pool]):
             i += 1
 
 
-def pools_from_contracts() -> Dict[str, Pool]:
-    return {info['contract']: Pool(pair, dex) for pair, dexes in pools_info.items()
-            for dex, info in dexes.items() if 'contract' in info}
+async def prefetch(pools: Iterable[Pool]):
+    """Query pools without liquidity in one batch for `simulate_sync` and `price_sync`
+    """
+    pools = [pool for pool in pools if pool.amount1 == dec_zero or pool.amount2 == dec_zero]
+    if pools:
+        await multi_pools_query(pools)
+
+
+class PoolStateStore:
+    """Process-wide `Pool` instances keyed by (pair, dex), queried at most once per block
+
+    Block height 0 means blocks aren't tracked and every load queries.
+    """
+    __slots__ = ('pools', 'heights', 'subscribers', 'height', 'version')
+
+    def __init__(self):
+        self.pools: Dict[Tuple[Pair, str], Pool] = {}
+        # Block height of the last query of each pool
+        self.heights: Dict[Pool, int] = {}
+        # Subscription counts
+        self.subscribers: Dict[Pool, int] = {}
+        # Block height and `pool_states` version of the last refresh
+        self.height = self.version = 0
+
+    def __repr__(self):
+        return f"PoolStateStore({len(self.pools)} pools, {len(self.subscribers)} subscribed, " \
+               f"height={self.height}, version={self.version})"
+
+    def pool(self, pair: Pair, dex: str) -> Pool:
+        """Shared instance of the pool
+        """
+        try:
+            return self.pools[pair, dex]
+        except KeyError:
+            pool = Pool(pair, dex)
+            pool = self.pools[pair, dex] = self.pools.setdefault((pool.pair, pool.dex), pool)
+            return pool
+
+    def subscribe(self, pools: Iterable[Pool]):
+        """Refresh `pools` every block
+        """
+        for pool in pools:
+            self.subscribers[pool] = self.subscribers.get(pool, 0) + 1
+
+    def unsubscribe(self, pools: Iterable[Pool]):
+        for pool in pools:
+            if pool in self.subscribers:
+                self.subscribers[pool] -= 1
+                if self.subscribers[pool] <= 0:
+                    del self.subscribers[pool]
+
+    async def load(self, pools: Iterable[Pool]):
+        """Query pools not queried in the current block in one batch
+        """
+        height = wallet.blockchain.block_height
+        pools = [pool for pool in dict.fromkeys(pools) if not height or self.heights.get(pool) != height]
+        if pools:
+            await multi_pools_query(pools)
+            for pool in pools:
+                self.heights[pool] = height
+
+    async def refresh(self):
+        """Query subscribed pools once per block
+        """
+        await self.load(self.subscribers)
+        self.height = wallet.blockchain.block_height
+        self.version = pool_states.version
+
+
+pool_store = PoolStateStore()
+
+
+class PoolContractMap(Mapping):
+    """Pools by contract of `registry`, built on first lookup
+    """
+    __slots__ = ()
+
+    def __getitem__(self, contract: str) -> Pool:
+        return pool_store.pool(*registry.pool_key(registry.contract_ids[contract]))
+
+    def __contains__(self, contract) -> bool:
+        return contract in registry.contract_ids
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(registry.contract_ids)
+
+    def __len__(self) -> int:
+        return len(registry.contract_ids)
+
+
+def pools_from_contracts() -> Mapping[str, Pool]:
+    return PoolContractMap()
 
 
 pool_contract_map = pools_from_contracts()
@@ -505,3 +889,78 @@ pool_contract_map = pools_from_contracts()
 
 def pool_from_contract(contract: str) -> Pool | None:
     return pool_contract_map.get(contract)
+
+
+class TokenGraph:
+    """Adjacency index of tokens trading on a DEX with integer token IDs
+
+    `dex` of '' indexes pairs on all DEXes.
+    """
+    __slots__ = ('dex', 'ids', 'tokens', 'adjacency', 'pairs')
+
+    def __init__(self, dex: str):
+        self.dex = dex
+        self.ids: Dict[str, int] = {}
+        self.tokens: List[str] = []
+        self.adjacency: List[List[int]] = []
+        self.pairs: Dict[Tuple[int, int], Pair] = {}
+        for pair in registry.pair_keys(dex):
+            self.add(pair)
+
+    def token_id(self, token: str) -> int:
+        """ID of `token`, assigned on first sight
+        """
+        try:
+            return self.ids[token]
+        except KeyError:
+            i = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+            self.adjacency.append([])
+            return i
+
+    def add(self, pair: Pair):
+        """Add an edge
+        """
+        i, j = (self.token_id(token) for token in pair.pair)
+        if (i, j) not in self.pairs:
+            self.pairs[i, j] = self.pairs[j, i] = pair
+            self.adjacency[i].append(j)
+            self.adjacency[j].append(i)
+
+    def adjacent(self, token: str) -> List[str]:
+        """Tokens forming a trading pair with `token`
+        """
+        if token not in self.ids:
+            return []
+        return [self.tokens[j] for j in self.adjacency[self.ids[token]]]
+
+    def pair(self, token1: str, token2: str) -> Pair:
+        """Shared `Pair` of an edge
+        """
+        return self.pairs[self.ids[token1], self.ids[token2]]
+
+
+token_graphs: Dict[str, TokenGraph] = {}
+
+
+def token_graph(dex: str) -> TokenGraph:
+    """Adjacency index of `dex`, built once
+    """
+    try:
+        return token_graphs[dex]
+    except KeyError:
+        graph = token_graphs[dex] = TokenGraph(dex)
+        return graph
+
+
+def register_pool(pair: Pair, dex: str, info: Dict):
+    """Register a pool discovered at runtime
+    """
+    pools_info.setdefault(pair, {})[dex] = info
+    registry.add_pool(pair, dex, info)
+    for token in pair.pair:
+        if dex not in get_dex(token):
+            tokens_info[token]['dex'] = get_dex(token) + (dex,)
+    for graph in (dex, ''):
+        if graph in token_graphs:
+            token_graphs[graph].add(pair)
@@ -0,0 +1,237 @@
+from typing import Dict, Iterable, Iterator, List, Tuple
+from src.consts import *
+import numpy as np
+import os
+
+registry_path = 'registry.npz'
+
+# Pool rows indexed by pool ID
+pool_dtype = np.dtype([('pair', '<u4'),
+                       ('dex', 'u1'),
+                       ('fee', '<f8'),
+                       ('tx_fee', '<f8'),
+                       ('stable', '?')])
+
+
+class Registry:
+    """Indexed tables of tokens, pairs, DEXes and pools
+
+    Rows are compiled from `tokens_info` and `pools_info` or loaded from a binary file.
+    `Pool` objects are built from them on first use.
+    """
+    __slots__ = ('tokens', 'token_ids', 'token_contracts', 'denom_ids', 'decimals', 'dexes', 'dex_ids',
+                 'pairs', 'pair_ids', 'pair_pools', 'pools', 'contracts', 'contract_ids', '_pairs')
+
+    def __init__(self):
+        self.tokens: List[str] = []
+        self.token_ids: Dict[str, int] = {}
+        # Contract of CW20 tokens or denomination of native tokens
+        self.token_contracts: List[str] = []
+        self.denom_ids: Dict[str, int] = {}
+        self.decimals: List[int] = []
+        self.dexes: List[str] = []
+        self.dex_ids: Dict[str, int] = {}
+        # Token IDs of pairs, the smaller first
+        self.pairs: List[Tuple[int, int]] = []
+        self.pair_ids: Dict[Tuple[int, int], int] = {}
+        # Pool IDs of each pair
+        self.pair_pools: List[List[int]] = []
+        self.pools = np.zeros(0, dtype=pool_dtype)
+        # Pool contracts, empty for the market module
+        self.contracts: List[str] = []
+        self.contract_ids: Dict[str, int] = {}
+        # Shared `Pair` of pair IDs, built on first use
+        self._pairs: Dict[int, Pair] = {}
+
+    def __repr__(self):
+        return f"Registry({len(self.tokens)} tokens, {len(self.pairs)} pairs, {len(self.pools)} pools)"
+
+    def __len__(self):
+        return len(self.pools)
+
+    @classmethod
+    def compile(cls, tokens: Dict[str, Dict], pools: Dict[Pair, Dict[str, Dict]]) -> 'Registry':
+        """Compile `tokens_info` and `pools_info`
+        """
+        registry = cls()
+        registry.merge(tokens, pools)
+        return registry
+
+    def merge(self, tokens: Dict[str, Dict], pools: Dict[Pair, Dict[str, Dict]]):
+        """Add tokens and pools not registered yet
+        """
+        for token, info in tokens.items():
+            if token not in self.token_ids:
+                self.add_token(token, info.get('contract', info.get('denom', token)), info['decimals'])
+        rows = []
+        for pair, dexes in pools.items():
+            for dex, info in dexes.items():
+                if not self.has(pair, dex):
+                    rows.append(self._add(pair, dex, info.get('contract', '')) +
+                                (info.get('fee', 0.), info.get('tx_fee', 0.), info.get('stable', False)))
+        if rows:
+            self.pools = np.concatenate((self.pools, np.array(rows, dtype=pool_dtype)))
+
+    def add_token(self, token: str, contract: str, decimals: int) -> int:
+        i = self.token_ids[token] = len(self.tokens)
+        self.tokens.append(token)
+        self.token_contracts.append(contract)
+        self.denom_ids[contract] = i
+        self.decimals.append(decimals)
+        return i
+
+    def _dex_id(self, dex: str) -> int:
+        try:
+            return self.dex_ids[dex]
+        except KeyError:
+            i = self.dex_ids[dex] = len(self.dexes)
+            self.dexes.append(dex)
+            return i
+
+    def _pair_id(self, pair: Pair) -> int:
+        key = tuple(self.token_ids[token] for token in pair.pair)
+        try:
+            return self.pair_ids[key]
+        except KeyError:
+            i = self.pair_ids[key] = len(self.pairs)
+            self.pairs.append(key)
+            self.pair_pools.append([])
+            return i
+
+    def _add(self, pair: Pair, dex: str, contract: str) -> Tuple[int, int]:
+        """Index a pool and return the head of its row
+        """
+        pair_id, dex_id = self._pair_id(pair), self._dex_id(dex)
+        i = len(self.contracts)
+        self.pair_pools[pair_id].append(i)
+        self.contracts.append(contract)
+        if contract:
+            self.contract_ids[contract] = i
+        return pair_id, dex_id
+
+    def add_pool(self, pair: Pair, dex: str, info: Dict) -> int:
+        """Register a pool discovered at runtime
+        """
+        self.merge({}, {pair: {dex: info}})
+        return len(self.pools) - 1
+
+    def pair(self, i: int) -> Pair:
+        """`Pair` of pair ID `i`
+        """
+        try:
+            return self._pairs[i]
+        except KeyError:
+            token1, token2 = self.pairs[i]
+            pair = self._pairs[i] = Pair(self.tokens[token1], self.tokens[token2])
+            return pair
+
+    def pool_key(self, i: int) -> Tuple[Pair, str]:
+        """Pair and DEX of pool ID `i`
+        """
+        row = self.pools[i]
+        return self.pair(int(row['pair'])), self.dexes[row['dex']]
+
+    def pool_ids(self, pair: Pair) -> List[int]:
+        key = tuple(self.token_ids.get(token, -1) for token in pair.pair)
+        return self.pair_pools[self.pair_ids[key]] if key in self.pair_ids else []
+
+    def dexes_of(self, pair: Pair) -> List[str]:
+        """DEXes trading `pair` in order of registration
+        """
+        return [self.dexes[self.pools['dex'][i]] for i in self.pool_ids(pair)]
+
+    def has(self, pair: Pair, dex: str) -> bool:
+        # Pools indexed by `merge` but without rows yet are new.
+        return dex in self.dex_ids and any(self.pools['dex'][i] == self.dex_ids[dex]
+                                           for i in self.pool_ids(pair) if i < len(self.pools))
+
+    def pool_info(self, pair: Pair, dex: str) -> Tuple[str, float, float, bool]:
+        """Contract, fee, transaction fee and stable flag of a pool
+
+        :raise KeyError: if not registered
+        """
+        dex_id = self.dex_ids[dex]
+        for i in self.pool_ids(pair):
+            row = self.pools[i]
+            if row['dex'] == dex_id:
+                return self.contracts[i], float(row['fee']), float(row['tx_fee']), bool(row['stable'])
+        raise KeyError((pair, dex))
+
+    def pair_keys(self, dex='') -> Iterator[Pair]:
+        """Pairs trading on `dex`, or on any DEX if ''
+        """
+        if not dex:
+            yield from (self.pair(i) for i in range(len(self.pairs)))
+        elif dex in self.dex_ids:
+            dex_id = self.dex_ids[dex]
+            dexes = self.pools['dex']
+            for i, pools in enumerate(self.pair_pools):
+                if any(dexes[j] == dex_id for j in pools):
+                    yield self.pair(i)
+
+    def token_from_contract(self, contract: str) -> str | None:
+        i = self.denom_ids.get(contract)
+        return None if i is None else self.tokens[i]
+
+    def token_infos(self, tokens: Iterable[str]) -> Dict[str, Dict]:
+        """Entries of `tokens_info` for `tokens`
+        """
+        dexes = [{} for _ in self.tokens]
+        for pair, dex in zip(self.pools['pair'].tolist(), self.pools['dex'].tolist()):
+            if self.dexes[dex] != 'native_swap':
+                for i in self.pairs[pair]:
+                    dexes[i][self.dexes[dex]] = None
+        infos = {}
+        for token in tokens:
+            i = self.token_ids[token]
+            contract = self.token_contracts[i]
+            infos[token] = {'contract': contract} if contract.startswith('terra1') else {'denom': contract}
+            infos[token].update(decimals=self.decimals[i], dex=tuple(dexes[i]))
+        return infos
+
+    def save(self, path=registry_path):
+        np.savez(path,
+                 tokens=np.array(self.tokens, dtype=str),
+                 token_contracts=np.array(self.token_contracts, dtype=str),
+                 decimals=np.array(self.decimals, dtype='u1'),
+                 dexes=np.array(self.dexes, dtype=str),
+                 pairs=np.array(self.pairs, dtype='<u4').reshape(-1, 2),
+                 pools=self.pools,
+                 contracts=np.array(self.contracts, dtype=str))
+
+    @classmethod
+    def load(cls, path=registry_path) -> 'Registry':
+        registry = cls()
+        with np.load(path) as data:
+            registry.tokens = data['tokens'].tolist()
+            registry.token_contracts = data['token_contracts'].tolist()
+            registry.decimals = data['decimals'].tolist()
+            registry.dexes = data['dexes'].tolist()
+            registry.pairs = [tuple(pair) for pair in data['pairs'].tolist()]
+            registry.pools = data['pools']
+            registry.contracts = data['contracts'].tolist()
+        registry.token_ids = {token: i for i, token in enumerate(registry.tokens)}
+        registry.denom_ids = {contract: i for i, contract in enumerate(registry.token_contracts)}
+        registry.dex_ids = {dex: i for i, dex in enumerate(registry.dexes)}
+        registry.pair_ids = {pair: i for i, pair in enumerate(registry.pairs)}
+        registry.pair_pools = [[] for _ in registry.pairs]
+        for i, pair in enumerate(registry.pools['pair'].tolist()):
+            registry.pair_pools[pair].append(i)
+        registry.contract_ids = {contract: i for i, contract in enumerate(registry.contracts) if contract}
+        return registry
+
+
+def load_registry(path=registry_path) -> Registry:
+    """Registry cached at `path` with local `pools_info`, or compiled from `pools_info` alone
+
+    Tokens only in the cache are added to `tokens_info`.
+    """
+    if not os.path.exists(path):
+        return Registry.compile(tokens_info, pools_info)
+    registry = Registry.load(path)
+    registry.merge(tokens_info, pools_info)
+    tokens_info.update(registry.token_infos([token for token in registry.tokens if token not in tokens_info]))
+    return registry
+
+
+registry = load_registry()
@@ -0,0 +1,209 @@
+from src.pool import *
+import re
+
+# Blocks between full re-syncs of subscribed pools
+resync_interval = 100
+# Oracle exchange rates change at the end of each vote period.
+vote_period = 5
+
+coin_pattern = re.compile(r'(\d+(?:\.\d+)?)([a-zA-Z][\w/]*)')
+
+
+def parse_coins(s: str) -> List[Tuple[str, Dec]]:
+    """Parse "1000uusd, 500terra1..." into (token, amount)
+    """
+    coins = []
+    for amount, asset in coin_pattern.findall(s):
+        token = token_from_contract(asset) if asset.startswith('terra1') else from_denom(asset)
+        coins.append((token, Dec(amount)))
+    return coins
+
+
+def contract_sections(log: TxLog) -> Iterator[Dict[str, str]]:
+    """Attributes of wasm events divided by contract
+
+    Terra emits the same attributes in `wasm` and legacy `from_contract` events.
+    """
+    events = [event['attributes'] for event in log.events if event['type'] == 'wasm']
+    if not events:
+        events = [event['attributes'] for event in log.events if event['type'] == 'from_contract']
+    for attributes in events:
+        section = None
+        for attribute in attributes:
+            if attribute['key'] == 'contract_address':
+                if section:
+                    yield section
+                section = {}
+            if section is not None:
+                section.setdefault(attribute['key'], attribute['value'])
+        if section:
+            yield section
+
+
+async def block_tx_infos(height: int) -> List[TxInfo]:
+    """Results of transactions in a block
+    """
+    infos = []
+    while True:
+        res = await terra.tx.search([['tx.height', height]], {'pagination.offset': str(len(infos)),
+                                                              'pagination.limit': '100',
+                                                              'pagination.count_total': 'true',
+                                                              'order_by': 'ORDER_BY_ASC'})
+        infos += res['txs']
+        if not res['txs'] or len(infos) >= int(res['pagination']['total']):
+            return infos
+
+
+async def block_tx_count(height: int) -> int:
+    """Number of transactions in a block
+    """
+    block = wallet.blockchain.block
+    if not block or int(block['header']['height']) != height:
+        block = (await terra.tendermint.block_info(height))['block']
+    return len(block['data']['txs'] or [])
+
+
+class ReserveSync:
+    """Incremental reserve updates of subscribed pools from block events
+
+    Swaps are checked against the pool math before they are applied. A pool failing the check or
+    with an unknown event is queried again at the end of the block, as are pools not synced to the
+    last block. All pools are re-synced if the LCD hasn't indexed every transaction of the block.
+    """
+    __slots__ = ('store', 'dirty', 'height', 'synced', 'stats')
+
+    def __init__(self, store=pool_store):
+        # Store of the subscribed pools
+        self.store = store
+        self.dirty: Dict[Pool, None] = {}
+        # Last block processed
+        self.height = 0
+        # Last full re-sync
+        self.synced = 0
+        # Hits are pools updated from events and misses pools queried.
+        self.stats = CacheStats()
+
+    def __repr__(self):
+        return f"ReserveSync(height={self.height}, synced={self.synced}, {self.stats})"
+
+    def _add(self, pool: Pool, token: str, amount: Dec) -> bool:
+        if token == pool.token1:
+            pool.amount1 += amount
+        elif token == pool.token2:
+            pool.amount2 += amount
+        else:
+            return False
+        return True
+
+    def apply_swap(self, pool: Pool, section: Dict[str, str]) -> bool:
+        """Apply a swap of a pair contract if the pool math reproduces it
+        """
+        bid = section.get('offer_asset', '')
+        bid = token_from_contract(bid) if bid.startswith('terra1') else from_denom(bid)
+        if bid not in pool.pair.pair:
+            return False
+        offer_amount, return_amount = Dec(section['offer_amount']), Dec(section['return_amount'])
+        if pool.simulate_sync(bid, offer_amount).ask_size != return_amount:
+            return False
+        # Astroport sends the maker fee out of the pool.
+        ask_amount = return_amount + Dec(section.get('maker_fee_amount', 0))
+        self._add(pool, bid, offer_amount)
+        self._add(pool, pool.pair.other(bid), -ask_amount)
+        return True
+
+    def apply_section(self, pool: Pool, section: Dict[str, str]) -> bool:
+        """Apply an event of a pair contract
+        """
+        match section.get('action'):
+            case 'swap':
+                return self.apply_swap(pool, section)
+            case 'provide_liquidity':
+                return all(self._add(pool, token, amount) for token, amount in parse_coins(section['assets']))
+            case 'withdraw_liquidity':
+                return all(self._add(pool, token, -amount) for token, amount in parse_coins(section['refund_assets']))
+            case _:
+                return False
+
+    async def apply_market_swap(self, pool: Pool, attributes: Dict[str, str]) -> bool:
+        """Apply a swap of the market module if the pool math reproduces it
+        """
+        (bid, bid_size), = parse_coins(attributes['offer'])
+        (ask, ask_size), = parse_coins(attributes['swap_coin'])
+        if Pair(bid, ask) != pool.pair:
+            # Terra<>Terra swaps don't move the pool. Other Terra<>Luna swaps need their exchange rates.
+            return 'luna' not in (bid, ask)
+        swap = pool.simulate_sync(bid, bid_size)
+        if swap.ask_size != ask_size:
+            return False
+        return await pool.simulate_msg(swap)
+
+    async def apply(self, infos: List[TxInfo], pools: Dict[Pool, int]):
+        """Apply events of transactions in a block to `pools`
+        """
+        native_swap = None
+        contracts = {}
+        for pool in pools:
+            if pool.dex == 'native_swap':
+                native_swap = pool
+            else:
+                contracts[pool.contract] = pool
+        for info in infos:
+            if info.code or not info.logs:
+                continue
+            for log in info.logs:
+                for section in contract_sections(log):
+                    pool = contracts.get(section['contract_address'])
+                    if pool is not None and pool not in self.dirty:
+                        if self.apply_section(pool, section):
+                            pool._invalidate()
+                        else:
+                            self.dirty[pool] = None
+                if native_swap and native_swap not in self.dirty:
+                    for event in log.events:
+                        if event['type'] == 'swap':
+                            attributes = {item['key']: item['value'] for item in event['attributes']}
+                            if not await self.apply_market_swap(native_swap, attributes):
+                                self.dirty[native_swap] = None
+        if native_swap and native_swap not in self.dirty:
+            # Replenished at the end of each block
+            native_swap.params['delta'] *= 1 - 1 / native_swap.params['pool_recovery_period']
+            native_swap._market_pools()
+            native_swap.recovered = False
+
+    async def resync(self, height: int):
+        """Query all subscribed pools at block `height`
+        """
+        await self.store.refresh()
+        self.stats.misses += len(self.store.subscribers)
+        self.height = self.synced = height
+
+    async def update(self, height: int):
+        """Bring subscribed pools to the state after block `height`
+        """
+        pools = self.store.subscribers
+        if height - self.synced >= resync_interval or height != self.height + 1:
+            return await self.resync(height)
+        infos, count = await asyncio.gather(block_tx_infos(height), block_tx_count(height))
+        if len(infos) != count:
+            # The LCD hasn't indexed the whole block yet.
+            return await self.resync(height)
+        # Pools not at the last block, such as those loaded earlier and subscribed since, are queried again.
+        for pool in pools:
+            if self.store.heights.get(pool) != self.height:
+                self.dirty[pool] = None
+        await self.apply(infos, pools)
+        for pool in pools:
+            if pool.dex == 'native_swap' and (height + 1) % vote_period == 0:
+                self.dirty[pool] = None
+        if self.dirty:
+            await multi_pools_query(self.dirty)
+        self.stats.hits += len(pools) - len(self.dirty)
+        self.stats.misses += len(self.dirty)
+        self.dirty.clear()
+        for pool in pools:
+            self.store.heights[pool] = height
+        self.store.height, self.store.version = height, pool_states.version
+        self.height = height
+
+
+reserve_sync = ReserveSync()
@@ -1,28 +1,38 @@
-from typing import Any, Iterable, Tuple, Union
+from typing import Any, Callable, Iterable, Iterator, Tuple, Union
 from functools import wraps
+from collections import Counter, defaultdict, deque
+from copy import copy
 from heapq import heappop, heappush
 from terra_sdk.core import AccAddress, Coin, Coins, Dec, TxLog
 from terra_sdk.core.market.msgs import MsgSwap
 from terra_sdk.core.wasm.msgs import MsgExecuteContract
 from terra_sdk.key.mnemonic import MnemonicKey
 from src.consts import *
+from src.registry import *
 from src.wallet import *
 from pprint import pprint
-import requests
+from aiohttp import ClientSession
+from time import perf_counter
+import time
 import base64
+import pickle
 import json
 
 if testnet:
     light_clinet_address = 'https://bombay-lcd.terra.dev'
+    fcd_address = 'https://bombay-fcd.terra.dev'
     chain_id = 'bombay-12'
-    gas_prices = requests.get('https://bombay-fcd.terra.dev/v1/txs/gas_prices').json()
 else:
     light_clinet_address = 'https://lcd.terra.dev'
+    fcd_address = 'https://fcd.terra.dev'
     chain_id = 'columbus-5'
-    gas_prices = requests.get('https://fcd.terra.dev/v1/txs/gas_prices').json()
+# Tendermint RPC websocket pushing new blocks, like 'ws://localhost:26657/websocket'. The LCD is polled if empty.
+rpc_address = ''
+# Queried by `init`
+gas_prices: Dict[str, str] = {}
 terra = AsyncLCDClient(chain_id=chain_id,
                        url=light_clinet_address,
-                       gas_prices=Coins(uusd=gas_prices['uusd']),
+                       gas_prices=Coins(uusd='0.15'),
                        gas_adjustment=1.2)
 
 
@@ -36,9 +46,17 @@ async def compare_fee():
     terra.gas_prices = Coins({fee_denom: gas_prices[fee_denom]})
 
 
+async def gas_prices_query():
+    """Query gas prices from FCD and choose the cheaper fee denomination
+    """
+    async with ClientSession() as session:
+        async with session.get(f'{fcd_address}/v1/txs/gas_prices') as res:
+            gas_prices.update(await res.json())
+    await compare_fee()
+
+
 loop = asyncio.get_event_loop_policy().get_event_loop()
 fee_denom = 'uusd'
-loop.run_until_complete(compare_fee())
 
 
 def base64str_decode(msg: str) -> Any:
@@ -54,25 +72,225 @@ def base64str_encode(obj: Any) -> str:
 
 
 seed_path = r'wall-e'
-# Store your seed phrases in 'seed_path'
-try:
-    with open(seed_path) as w:
-        seed = w.readline()
 
-    if len(seed.split()) > 1:
-        # Encode plain seed phrases
+
+def load_key() -> MnemonicKey:
+    """Key from seed phrases in `seed_path`, generated if missing
+    """
+    # Store your seed phrases in 'seed_path'
+    try:
+        with open(seed_path) as w:
+            seed = w.readline()
+
+        if len(seed.split()) > 1:
+            # Encode plain seed phrases
+            with open(seed_path, 'w') as w:
+                seed = base64str_encode(seed)
+                w.write(seed)
+    except OSError:
+        seed = MnemonicKey().mnemonic
+        print(f"Generated new seed phrase in {seed_path}. Go fund it.\n{seed}")
         with open(seed_path, 'w') as w:
-            seed = base64str_encode(seed)
-            w.write(seed)
-except OSError:
-    seed = MnemonicKey().mnemonic
-    print(f"Generated new seed phrase in {seed_path}. Go fund it.\n{seed}")
-    with open(seed_path, 'w') as w:
-        w.write(base64str_encode(seed))
-    exit()
+            w.write(base64str_encode(seed))
+        exit()
+    return MnemonicKey(base64str_decode(seed))
 
-mk = MnemonicKey(base64str_decode(seed))
-wallet: AsyncWallet = loop.run_until_complete(AsyncWallet(terra, mk))
+
+# Key is loaded on first use and account by `init`.
+wallet: AsyncWallet = AsyncWallet(terra, load_key)
+wallet.blockchain.rpc = rpc_address
+
+
+async def init(account=True):
+    """Load gas prices and wallet account concurrently before trading
+
+    Simulation, routing and backtesting don't need it. Loaded parts are skipped on later calls.
+    """
+    tasks = []
+    if not gas_prices:
+        tasks.append(gas_prices_query())
+    if account and wallet._account_number is None:
+        tasks.append(wallet.account_number_and_sequence())
+    await asyncio.gather(*tasks)
+
+
+class CacheStats:
+    """Hit and miss counters of a cache
+    """
+    __slots__ = ('hits', 'misses')
+
+    def __init__(self):
+        self.hits = self.misses = 0
+
+    def __repr__(self):
+        return f"CacheStats(hits={self.hits}, misses={self.misses}, hit_rate={self.hit_rate:.2%})"
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def reset(self):
+        self.hits = self.misses = 0
+
+
+class ResponseCache:
+    """Responses of LCD requests cached by policy of endpoint and persisted across restarts
+
+    A policy is 'governance' for results changed only by governance, refreshed after
+    `governance_period` seconds, 'block' for results valid within a block height, or a TTL in seconds.
+    Endpoints of contract queries are qualified by the query, as in 'wasm.pair'.
+    """
+    __slots__ = ('path', 'policies', 'entries', 'block_height', 'stats')
+
+    governance_period = 86400
+
+    def __init__(self, path='responses.pkl', block_height: Callable[[], int] = lambda: 0,
+                 policies: Dict[str, str | float] | None = None):
+        self.path = path
+        self.policies = {'market.parameters': 'governance',
+                         'oracle.parameters': 'governance',
+                         'wasm.pair': 'governance'} if policies is None else policies
+        for endpoint, policy in self.policies.items():
+            if policy not in ('governance', 'block') and not isinstance(policy, (int, float)):
+                raise ValueError(f"Unknown policy {policy!r} of {endpoint}")
+        self.block_height = block_height
+        # (endpoint, arguments) -> (height, time, response)
+        self.entries: Dict[Tuple[str, str], Tuple[int, float, Any]] = {}
+        try:
+            with open(path, 'rb') as f:
+                self.entries = {key: entry for key, entry in pickle.load(f).items()
+                                if self.policy(key[0]) not in (None, 'block')}
+        except (OSError, pickle.PickleError, EOFError):
+            pass
+        self.stats: Dict[str, CacheStats] = defaultdict(CacheStats)
+
+    def __repr__(self):
+        return f"ResponseCache({len(self.entries)} entries, {dict(self.stats)})"
+
+    def policy(self, endpoint: str) -> str | float | None:
+        return self.policies.get(endpoint)
+
+    def get(self, key: Tuple[str, str]) -> Any:
+        """Cached response of `key` if still valid
+
+        :raise KeyError: if missing or expired
+        """
+        endpoint = key[0]
+        policy = self.policy(endpoint)
+        if policy is None:
+            raise KeyError(key)
+        entry = self.entries.get(key)
+        if entry is not None:
+            height, stored, res = entry
+            match policy:
+                case 'governance':
+                    valid = time.time() - stored < self.governance_period
+                case 'block':
+                    valid = height and height == self.block_height()
+                case int() | float() as ttl:
+                    valid = time.time() - stored < ttl
+                case _:
+                    raise ValueError(f"Unknown policy {policy!r} of {endpoint}")
+            if valid:
+                self.stats[endpoint].hits += 1
+                return res
+            del self.entries[key]
+        self.stats[endpoint].misses += 1
+        raise KeyError(key)
+
+    def put(self, key: Tuple[str, str], res: Any):
+        policy = self.policy(key[0])
+        if policy is None:
+            return
+        self.entries[key] = self.block_height(), time.time(), res
+        if policy != 'block':
+            self.save()
+
+    def invalidate(self, endpoint: str | None = None):
+        """Drop responses of `endpoint`, or all, say after a governance proposal passed
+        """
+        self.entries = {key: entry for key, entry in self.entries.items() if endpoint not in (None, key[0])}
+        self.save()
+
+    def save(self):
+        persistent = {key: entry for key, entry in self.entries.items() if self.policy(key[0]) != 'block'}
+        with open(self.path, 'wb') as f:
+            pickle.dump(persistent, f)
+
+
+class RequestCoalescer:
+    """Identical LCD requests in flight share one future
+
+    Requests are keyed on (endpoint, arguments) and looked up in a `ResponseCache` first.
+    Callers get shallow copies since pools mutate some results.
+    """
+    __slots__ = ('pending', 'cache', 'stats')
+
+    endpoints = {'wasm': ('contract_query',),
+                 'bank': ('balance', 'total'),
+                 'market': ('parameters', 'swap_rate', 'terra_pool_delta'),
+                 'oracle': ('exchange_rate', 'exchange_rates', 'parameters')}
+
+    def __init__(self, cache: ResponseCache | None = None):
+        self.pending: Dict[Tuple[str, str], asyncio.Future] = {}
+        self.cache = cache
+        # Hits are requests shared and misses requests sent.
+        self.stats = CacheStats()
+
+    def __repr__(self):
+        return f"RequestCoalescer({len(self.pending)} in flight, {self.stats})"
+
+    @staticmethod
+    def endpoint(endpoint: str, args: Tuple) -> str:
+        """Endpoint qualified by the kind of contract query
+        """
+        if endpoint == 'wasm.contract_query' and len(args) > 1 and isinstance(args[1], dict) and args[1]:
+            return f"wasm.{next(iter(args[1]))}"
+        return endpoint
+
+    async def request(self, endpoint: str, func: Callable, *args, **kwargs) -> Any:
+        """Result of `func(*args, **kwargs)`, shared with identical requests
+        """
+        key = self.endpoint(endpoint, args), json.dumps([args, kwargs], sort_keys=True, default=str)
+        if self.cache is not None:
+            try:
+                return copy(self.cache.get(key))
+            except KeyError:
+                pass
+        future = self.pending.get(key)
+        if future is None:
+            self.stats.misses += 1
+            future = self.pending[key] = asyncio.ensure_future(func(*args, **kwargs))
+            future.add_done_callback(lambda _: self.pending.pop(key, None))
+            # A cancelled caller doesn't cancel the others.
+            res = await asyncio.shield(future)
+            if self.cache is not None:
+                self.cache.put(key, res)
+        else:
+            self.stats.hits += 1
+            res = await asyncio.shield(future)
+        return copy(res)
+
+    def wrap(self, endpoint: str, func: Callable) -> Callable:
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await self.request(endpoint, func, *args, **kwargs)
+
+        return wrapper
+
+    def install(self, lcd: AsyncLCDClient):
+        """Coalesce queries of `lcd` to the wasm, bank, market and oracle modules
+        """
+        for module, methods in self.endpoints.items():
+            api = getattr(lcd, module)
+            for method in methods:
+                setattr(api, method, self.wrap(f"{module}.{method}", getattr(api, method)))
+
+
+response_cache = ResponseCache(block_height=lambda: wallet.blockchain.block_height)
+coalescer = RequestCoalescer(response_cache)
+coalescer.install(terra)
 
 
 def from_Dec(
@@ -477,6 +695,8 @@ class ABI(Dict):
     class multicall_query(Dict):
         def __init__(self, contract: AccAddress, query: Dict):
             super().__init__(address=contract, data=base64str_encode(query), require_success=True)
+            # Key of the query message for gas weights
+            self.kind = next(iter(query))
 
     @classmethod
     def aggregate(cls, queries: List[multicall_query]):
@@ -487,37 +707,154 @@ class ABI(Dict):
         })
 
 
-multicall_limit = 20
-multicall_retry = 10
+# Tolerance of batch weights for accumulated float error
+weight_tolerance = 1e-9
+
+
+class MulticallBatcher:
+    """Batches of Multicall queries packed near the gas ceiling of a contract query
+
+    Gas weights of each kind of query, in units of the ceiling, are fitted by least squares to the query
+    counts of the latest batches that ran within the ceiling or ran out of gas. A stable pool costs a
+    `pool` and a `config` query. A batch running out of gas is split. Queries needing several batches without
+    running out of gas lower the weights so batches grow back.
+    """
+    __slots__ = ('lcd', 'contract', 'weights', 'default_weight', 'outcomes', 'semaphore', 'retries', 'backoff',
+                 'latencies', 'failures')
+
+    def __init__(self, lcd: AsyncLCDClient, contract=multicall, concurrency=8, retries=10, backoff=0.1):
+        self.lcd = lcd
+        self.contract = contract
+        # Share of the gas ceiling by kind of query
+        self.weights: Dict[str, float] = {}
+        self.default_weight = 1 / 20
+        # (queries by kind, ran within the ceiling) of the latest batches
+        self.outcomes = deque(maxlen=1000)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        # (queries, weight, seconds) of the latest batches
+        self.latencies = deque(maxlen=1000)
+        # Batches out of gas
+        self.failures = 0
+
+    def __repr__(self):
+        return f"MulticallBatcher({len(self.latencies)} batches, {self.failures} out of gas, " \
+               f"mean {self.mean_latency * 1000:.1f}ms, " \
+               f"weights={ {kind: round(weight, 4) for kind, weight in self.weights.items()} })"
+
+    @property
+    def mean_latency(self) -> float:
+        return sum(latency for _, _, latency in self.latencies) / len(self.latencies) if self.latencies else 0.
+
+    def weight(self, query: ABI.multicall_query) -> float:
+        return self.weights.get(query.kind, self.default_weight)
+
+    def pack(self, queries: List[ABI.multicall_query]) -> List[List[ABI.multicall_query]]:
+        """Split `queries` in order into batches with total weight up to 1
+        """
+        batches, batch, total = [], [], 0.
+        for query in queries:
+            weight = self.weight(query)
+            if batch and total + weight > 1 + weight_tolerance:
+                batches.append(batch)
+                batch, total = [], 0.
+            batch.append(query)
+            total += weight
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _fit(self, batch: List[ABI.multicall_query], ran: bool):
+        """Record the outcome of `batch` and refit the weights if they got it wrong
+
+        Least squares over the outcomes the weights get wrong, batches that ran at the ceiling and those
+        out of gas just above, with the weights held near their current values. Outcomes that become
+        wrong are added over a few rounds.
+        """
+        self.outcomes.append((Counter(query.kind for query in batch), ran))
+        if (sum(self.weight(query) for query in batch) <= 1 + weight_tolerance) == ran:
+            return
+        kinds = list({kind: None for counts, _ in self.outcomes for kind in counts})
+        counts = np.array([[counts[kind] for kind in kinds] for counts, _ in self.outcomes], dtype=float)
+        within = np.array([ran for _, ran in self.outcomes], dtype=bool)
+        targets = np.where(within, 1., 1.05)
+        prior = np.array([self.weights.get(kind, self.default_weight) for kind in kinds])
+        weights = prior
+        fitted = np.zeros(len(within), dtype=bool)
+        for _ in range(8):
+            totals = counts @ weights
+            wrong = np.where(within, totals > 1 + weight_tolerance, totals <= 1 + weight_tolerance)
+            if not (wrong & ~fitted).any():
+                break
+            fitted |= wrong
+            weights = np.linalg.lstsq(np.vstack((counts[fitted], np.eye(len(kinds)))),
+                                      np.concatenate((targets[fitted], prior)), rcond=None)[0]
+            weights = np.clip(weights, 1e-3, 1.)
+        self.weights.update(zip(kinds, weights.tolist()))
+
+    def _shrink(self, kinds: Iterable[str]):
+        """Lower the weights of `kinds` by 1% unless a latest batch out of gas would fit
+        """
+        shrunk = {kind: self.weights.get(kind, self.default_weight) * 0.99 for kind in kinds}
+        for counts, ran in self.outcomes:
+            if not ran and sum(shrunk.get(kind, self.weights.get(kind, self.default_weight)) * n
+                               for kind, n in counts.items()) <= 1 + weight_tolerance:
+                return
+        self.weights.update(shrunk)
+
+    async def _aggregate(self, batch: List[ABI.multicall_query]) -> List[Dict]:
+        """Run one batch, retrying only this batch
+        """
+        for attempt in range(self.retries):
+            try:
+                async with self.semaphore:
+                    start = perf_counter()
+                    response = await self.lcd.wasm.contract_query(self.contract, ABI.aggregate(batch))
+                    latency = perf_counter() - start
+            except LCDResponseError as exc:
+                if 'out of gas' in exc.message:
+                    self.failures += 1
+                    self._fit(batch, False)
+                    if len(batch) == 1:
+                        raise exc
+                    batches = self.pack(batch)
+                    if len(batches) == 1:
+                        batches = [batch[:len(batch) // 2], batch[len(batch) // 2:]]
+                    res = []
+                    for msgs in await asyncio.gather(*map(self._aggregate, batches)):
+                        res.extend(msgs)
+                    return res
+                if attempt + 1 == self.retries:
+                    raise exc
+                # Retry for network errors
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+            else:
+                self.latencies.append((len(batch), sum(self.weight(query) for query in batch), latency))
+                self._fit(batch, True)
+                return response['return_data']
+
+    async def query(self, queries: List[ABI.multicall_query]) -> List[Dict]:
+        """Aggregate multiple queries using Multicall contract
+        """
+        failures = self.failures
+        batches = self.pack(queries)
+        msgs = []
+        for batch in await asyncio.gather(*map(self._aggregate, batches)):
+            msgs.extend(batch)
+        if len(batches) > 1 and self.failures == failures:
+            self._shrink({query.kind for query in queries})
+        res = []
+        for msg in msgs:
+            assert msg['success']
+            res.append(base64str_decode(msg['data']))
+        return res
+
+
+multicaller = MulticallBatcher(terra)
 
 
 async def multicall_query(queries: List[ABI.multicall_query]) -> List[Dict]:
     """Aggregate multiple queries using Multicall contract
     """
-    global multicall_limit
-    try:
-        nmsgs = 0
-        tasks = []
-        while nmsgs < len(queries):
-            aggregate = ABI.aggregate(queries[nmsgs:nmsgs + multicall_limit])
-            tasks.append(terra.wasm.contract_query(multicall, aggregate))
-            nmsgs += multicall_limit
-        msgs = []
-        for response in await asyncio.gather(*tasks):
-            msgs.extend(response['return_data'])
-    except LCDResponseError as exc:
-        # print('multicall_query', exc)
-        global multicall_retry
-        if 'out of gas' in exc.message:
-            multicall_limit -= 1
-        multicall_retry -= 1
-        if multicall_retry:
-            # Retry for network errors
-            return await multicall_query(queries)
-        else:
-            raise exc
-    res = []
-    for msg in msgs:
-        assert msg['success']
-        res.append(base64str_decode(msg['data']))
-    return res
+    return await multicaller.query(queries)
@@ -1,4 +1,4 @@
-from typing import Dict, List
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Tuple
 from terra_sdk.client.lcd import AsyncLCDClient, AsyncWallet as _AsyncWallet
 from terra_sdk.client.lcd.api.tx import CreateTxOptions, SignerOptions
 from terra_sdk.core import Tx, TxInfo
@@ -8,9 +8,30 @@ from terra_sdk.core.msg import Msg
 from terra_sdk.util.hash import hash_amino
 from terra_sdk.exceptions import LCDResponseError
 from terra_sdk.key.key import Key
-from aiohttp import ClientError
+from aiohttp import ClientError, ClientSession, WSMsgType
 from src.schema import *
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 import asyncio
+import base64
+import json
+import time
+
+# Polled blocks between attempts to subscribe again
+resubscribe_blocks = 100
+# Transactions in a block from which they are decoded by worker processes
+parallel_decode = 16
+# Transactions decoded per task
+decode_chunk = 8
+# Worker processes decoding transactions
+decode_workers = 4
+
+
+def decode_txs(raw_txs: List[bytes]) -> List[Tx]:
+    """Decode raw transactions
+    """
+    return [Tx.from_bytes(tx) for tx in raw_txs]
 
 
 class async_property(property):
@@ -43,25 +64,116 @@ class async_property(property):
         super().__init__(getter, setter, doc=fget.__doc__)
 
 
+def header_time(block: Dict) -> float:
+    """Unix time of a block header
+    """
+    # Tendermint time has nanoseconds.
+    stamp = block['header']['time'].rstrip('Z')
+    if '.' in stamp:
+        stamp, fraction = stamp.split('.')
+        stamp = f'{stamp}.{fraction[:6]}'
+    return datetime.fromisoformat(stamp + '+00:00').timestamp()
+
+
+class BlockTimer:
+    """Predictor of new blocks from intervals of header timestamps
+
+    The expected interval is an EWMA of recent intervals. Polling is dense from the `low` to the
+    `high` quantile of recent intervals, offset by the smallest recent detection lag.
+    """
+    __slots__ = ('alpha', 'ewma', 'intervals', 'lags', 'last', 'height', 'low', 'high', 'requests', 'blocks')
+
+    def __init__(self, alpha=0.1, window=100, low=0.1, high=0.9):
+        self.alpha = alpha
+        self.ewma = 6.
+        self.intervals = deque(maxlen=window)
+        # Seconds from header time to detection
+        self.lags = deque(maxlen=window)
+        # Header time and height of the last block
+        self.last = 0.
+        self.height = 0
+        self.low = low
+        self.high = high
+        # Block queries and blocks detected by polling
+        self.requests = self.blocks = 0
+
+    def __repr__(self):
+        return f"BlockTimer(interval {self.ewma:.3f}s, {self.requests_per_block:.1f} requests per block, " \
+               f"detection lag {self.detection_lag:.3f}s)"
+
+    @staticmethod
+    def quantile(values: Iterable[float], q: float) -> float:
+        values = sorted(values)
+        return values[round(q * (len(values) - 1))]
+
+    @property
+    def requests_per_block(self) -> float:
+        return self.requests / self.blocks if self.blocks else 0.
+
+    @property
+    def detection_lag(self) -> float:
+        """Median seconds from header time to detection
+        """
+        return self.quantile(self.lags, 0.5) if self.lags else 0.
+
+    def observe(self, block: Dict, arrival: float):
+        """Record a block detected at Unix time `arrival`
+        """
+        stamp, height = header_time(block), int(block['header']['height'])
+        if self.height and height > self.height:
+            # Per block if some were missed
+            interval = (stamp - self.last) / (height - self.height)
+            self.ewma += self.alpha * (interval - self.ewma) if self.intervals else interval - self.ewma
+            self.intervals.append(interval)
+        self.last, self.height = stamp, height
+        self.lags.append(arrival - stamp)
+
+    def window(self) -> Tuple[float, float]:
+        """Unix times between which the next block is expected to be detected
+        """
+        # Blocks aren't detected sooner than the fastest recent detection.
+        lag = min(self.lags) if self.lags else 0.
+        if len(self.intervals) < 10:
+            return self.last + self.ewma * 0.8 + lag, self.last + self.ewma * 1.5 + lag
+        return self.last + min(self.quantile(self.intervals, self.low), self.ewma) + lag, \
+            self.last + max(self.quantile(self.intervals, self.high), self.ewma) + lag
+
+
 class BlockChain:
-    __slots__ = ('block', 'current_height', 'lcd', 'new_block_evt', 'interval', 'initial_block', 'loop', 'start_time')
+    """Async iterator over new blocks
+
+    Blocks are pushed by a `NewBlock` subscription to the Tendermint RPC websocket `rpc` if set.
+    The LCD is polled without it or while the subscription fails.
+    """
+    __slots__ = ('block', 'current_height', 'executor', 'lcd', 'new_block_evt', 'interval', 'initial_block', 'loop',
+                 'rpc', 'timeout', 'timer', 'workers')
 
-    def __init__(self, lcd: AsyncLCDClient):
+    def __init__(self, lcd: AsyncLCDClient, rpc='', workers=decode_workers):
         self.lcd = lcd
         self.block = {}
         self.current_height = 0
         self.initial_block = 0
         self.interval = 0.04
         self.loop = asyncio.get_event_loop()
-        self.start_time = self.loop.time()
         self.new_block_evt = asyncio.Event()
+        self.rpc = rpc
+        # Seconds without a block before falling back to polling
+        self.timeout = 30
+        self.timer = BlockTimer()
+        # Worker processes decoding large blocks, started by the first
+        self.executor: ProcessPoolExecutor | None = None
+        self.workers = workers
+
+    def close(self):
+        """Shut down the worker processes
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
 
     @property
     def average_block_time(self):
-        if self.block_height - self.initial_block:
-            return (self.loop.time() - self.start_time) / (self.block_height - self.initial_block)
-        else:
-            return 6
+        return self.timer.ewma
 
     async def block_info(self):
         try:
@@ -76,27 +188,49 @@ class BlockChain:
         return int(self.block['header']['height']) if self.block else 0
 
     async def set_new_block(self):
+        self.timer.requests += 1
         await self.block_info()
         if self.block_height > self.current_height:
             if not self.new_block_evt.is_set():
                 self.new_block_evt.set()
                 self.current_height = self.block_height
+                self.timer.blocks += 1
+                self.timer.observe(self.block, time.time())
 
-    async def __aiter__(self):
-        """AsyncGenerator iterating over blocks
+    async def subscribe(self) -> AsyncIterator[Dict]:
+        """Blocks pushed by the websocket of `rpc`
+        """
+        async with ClientSession() as session:
+            async with session.ws_connect(self.rpc, heartbeat=self.timeout) as ws:
+                await ws.send_json({'jsonrpc': '2.0', 'method': 'subscribe', 'id': 0,
+                                    'params': {'query': "tm.event='NewBlock'"}})
+                while True:
+                    msg = await ws.receive(timeout=self.timeout)
+                    if msg.type != WSMsgType.TEXT:
+                        raise ClientError(f'websocket {msg.type.name}')
+                    res = json.loads(msg.data)
+                    if 'error' in res:
+                        raise ClientError(res['error'])
+                    block = res['result'].get('data', {}).get('value', {}).get('block')
+                    if block:
+                        yield block
+
+    async def poll(self, blocks: int | None = None) -> AsyncIterator[Dict]:
+        """Blocks polled from the LCD, up to `blocks` of them
         """
-        block_time = self.loop.time()
         await self.set_new_block()
-        self.initial_block = self.block_height
         yield self.block
-        while True:
-            await asyncio.sleep(self.average_block_time - 0.2 - self.loop.time() + block_time)
+        while blocks is None or blocks > 1:
+            start, end = self.timer.window()
+            await asyncio.sleep(start - time.time())
             self.new_block_evt.clear()
             try:
                 while not self.new_block_evt.is_set():
                     asyncio.create_task(self.set_new_block())
-                    await asyncio.sleep(self.interval)
-                block_time = self.loop.time()
+                    # Sparse polling once the block is late
+                    await asyncio.sleep(self.interval if time.time() < end else self.interval * 5)
+                if blocks is not None:
+                    blocks -= 1
                 yield self.block
             except LCDResponseError as exc:
                 print('__aiter__', exc)
@@ -105,9 +239,62 @@ class BlockChain:
                     self.interval *= 1.2
                 pass
 
-    async def transactions(self) -> List[Tx]:
+    async def __aiter__(self):
+        """AsyncGenerator iterating over blocks
+
+        Polling retries the subscription every `resubscribe_blocks` blocks.
+        """
+        height = 0
+        while True:
+            if self.rpc:
+                try:
+                    async for block in self.subscribe():
+                        self.block = block
+                        if self.block_height > height:
+                            self.timer.observe(block, time.time())
+                            height = self.current_height = self.block_height
+                            self.initial_block = self.initial_block or height
+                            yield block
+                except (ClientError, asyncio.TimeoutError, KeyError, ValueError) as exc:
+                    print(f'Polling LCD after websocket error {exc!r}')
+            async for block in self.poll(resubscribe_blocks if self.rpc else None):
+                if self.block_height > height:
+                    height = self.block_height
+                    self.initial_block = self.initial_block or height
+                    yield block
+
+    async def stream(self, prefilter: Callable[[bytes], bool] | None = None) -> AsyncIterator[Tx]:
+        """Transactions of the block decoded locally, in order
+
+        Large blocks are decoded in chunks by the worker processes so that the first transactions are
+        yielded while the others are decoded. The workers are kept until `close`.
+
+        :param prefilter: predicate on raw transactions selecting those to decode
+        """
         if not self.block: await self.block_info()
-        return [await self.lcd.tx.decode(encoded_tx) for encoded_tx in self.block['data']['txs']]
+        raw_txs = [base64.b64decode(tx) for tx in self.block['data']['txs'] or []]
+        if prefilter is not None:
+            raw_txs = [tx for tx in raw_txs if prefilter(tx)]
+        if len(raw_txs) < parallel_decode:
+            for tx in decode_txs(raw_txs):
+                yield tx
+            return
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers)
+        loop = asyncio.get_running_loop()
+        chunks = [loop.run_in_executor(self.executor, decode_txs, raw_txs[i:i + decode_chunk])
+                  for i in range(0, len(raw_txs), decode_chunk)]
+        try:
+            for chunk in chunks:
+                for tx in await chunk:
+                    yield tx
+        finally:
+            # Chunks left by a stream closed early aren't decoded.
+            for chunk in chunks:
+                chunk.cancel()
+
+    async def transactions(self) -> List[Tx]:
+        return [tx async for tx in self.stream()]
 
     async def hashes(self) -> List[str]:
         if not self.block: await self.block_info()
@@ -117,18 +304,29 @@ class BlockChain:
 class AsyncWallet(_AsyncWallet):
     """Custom AsyncWallet initialized by `await AsyncWallet(lcd, key)`\n
     `wallet.sequence` is automatically incremented.
+    `key` may be a function loading the key on first use.
     """
-    __slots__ = ('_account_number', 'blockchain', 'key', 'lcd', '_sequence')
+    __slots__ = ('_account_number', 'blockchain', '_key', 'lcd', '_sequence')
     account_number = async_property(_AsyncWallet.account_number)
     # Nonce
     sequence = async_property(_AsyncWallet.sequence)
 
-    def __init__(self, lcd: AsyncLCDClient, key: Key):
+    def __init__(self, lcd: AsyncLCDClient, key: Key | Callable[[], Key]):
         self._account_number = None
         self._sequence = None
         self.blockchain = BlockChain(lcd)
         self.lcd = lcd
-        self.key = key
+        self._key = key
+
+    @property
+    def key(self) -> Key:
+        if not isinstance(self._key, Key):
+            self._key = self._key()
+        return self._key
+
+    @key.setter
+    def key(self, key: Key):
+        self._key = key
 
     def __await__(self):
         yield from asyncio.create_task(self.account_number_and_sequence())
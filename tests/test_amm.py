@@ -0,0 +1,113 @@
+from fractions import Fraction
+from src.amm import DECIMAL_FRACTIONAL, N_COINS, _chop_precision_and_round, compute_d, \
+    compute_new_balance_out, constant_product_reverse_swap, constant_product_swap, market_swap, sdk_mul, \
+    sdk_quo, stable_reverse_swap, stable_swap, to_decimal
+import unittest
+
+# Decimal atomics
+ONE = DECIMAL_FRACTIONAL
+COMMISSION = to_decimal('0.003')
+STABLE_COMMISSION = to_decimal('0.0005')
+MIN_SPREAD = to_decimal('0.005')
+
+
+def exact_d(leverage: int, amount_a: int, amount_b: int) -> Fraction:
+    """Root of the stable swap invariant by bisection in rationals
+
+    leverage * S + D = leverage * D + D ** 3 / (4 * a * b)
+    """
+    def f(d):
+        return leverage * (amount_a + amount_b) + d - leverage * d - d ** 3 / (4 * amount_a * amount_b)
+
+    low, high = Fraction(0), Fraction(2 * (amount_a + amount_b))
+    for _ in range(128):
+        mid = (low + high) / 2
+        low, high = (mid, high) if f(mid) > 0 else (low, mid)
+    return low
+
+
+class TestConstantProduct(unittest.TestCase):
+    # (offer_pool, ask_pool, offer_amount) -> (return_amount, spread_amount, commission_amount)
+    vectors = {
+        # ask_pool - cp / (offer_pool + offer_amount) = 90.909..., floored to 90, commission 0.27 to 0
+        (1000, 1000, 100): (90, 10, 0),
+        # 999.000999... floored to 999, commission 2.997 to 2
+        (10 ** 6, 10 ** 6, 1000): (997, 1, 2),
+        (10 ** 12, 2 * 10 ** 12, 10 ** 9): (1992007993, 1998002, 5994005),
+    }
+
+    def test_swap(self):
+        for (offer_pool, ask_pool, offer_amount), expected in self.vectors.items():
+            with self.subTest(offer_pool=offer_pool, ask_pool=ask_pool, offer_amount=offer_amount):
+                self.assertEqual(constant_product_swap(offer_pool, ask_pool, offer_amount, COMMISSION), expected)
+
+    def test_reverse_swap(self):
+        # 997 / (1 - 0.003) = 999.9999... floored to 999, and cp // (ask_pool - 999) - offer_pool = 999
+        self.assertEqual(constant_product_reverse_swap(10 ** 6, 10 ** 6, 997, COMMISSION), (999, 0, 2))
+        with self.assertRaises(ValueError):
+            constant_product_reverse_swap(1000, 1000, 1000, COMMISSION)
+
+
+class TestStableSwap(unittest.TestCase):
+
+    def test_balanced_d(self):
+        self.assertEqual(compute_d(200, 10 ** 6, 10 ** 6), 2 * 10 ** 6)
+        self.assertEqual(compute_d(200, 0, 0), 0)
+
+    def test_d_converges_to_floor_of_root(self):
+        for leverage, amount_a, amount_b, d in ((200, 10 ** 9, 3 * 10 ** 9, 3993431643),
+                                                (2, 10 ** 9, 3 * 10 ** 9, 3717778143),
+                                                (20, 1, 10 ** 12, 430828144)):
+            with self.subTest(leverage=leverage, amount_a=amount_a, amount_b=amount_b):
+                self.assertEqual(compute_d(leverage, amount_a, amount_b), d)
+                self.assertEqual(d, int(exact_d(leverage, amount_a, amount_b)))
+
+    def test_new_balance_keeps_d(self):
+        leverage, d = 200, compute_d(200, 10 ** 9, 3 * 10 ** 9)
+        y = compute_new_balance_out(leverage, 2 * 10 ** 9, d)
+        # Floor of the exact balance 1993431696.48
+        self.assertEqual(y, 1993431696)
+        self.assertLessEqual(abs(compute_d(leverage, 2 * 10 ** 9, y) - d), N_COINS)
+
+    def test_swap(self):
+        # 999991 out before a commission of 499.9955 floored to 499
+        self.assertEqual(stable_swap(10 ** 9, 10 ** 9, 10 ** 6, 100, STABLE_COMMISSION), (999492, 9, 499))
+        self.assertEqual(stable_swap(10 ** 9, 3 * 10 ** 9, 10 ** 8, 10, STABLE_COMMISSION), (113976559, 0, 57016))
+        d = compute_d(200, 10 ** 9, 10 ** 9)
+        self.assertEqual(stable_swap(10 ** 9, 10 ** 9, 10 ** 6, 100, STABLE_COMMISSION, d),
+                         stable_swap(10 ** 9, 10 ** 9, 10 ** 6, 100, STABLE_COMMISSION))
+
+    def test_reverse_swap(self):
+        offer_amount, _, _ = stable_reverse_swap(10 ** 9, 10 ** 9, 999492, 100, STABLE_COMMISSION)
+        self.assertEqual(stable_swap(10 ** 9, 10 ** 9, offer_amount, 100, STABLE_COMMISSION)[0], 999492)
+
+
+class TestMarket(unittest.TestCase):
+
+    def test_bankers_rounding(self):
+        # 0.5, 1.5, 2.5, -2.5, 0.5 + 1e-18 and 3.5
+        values = (ONE // 2, 3 * ONE // 2, 5 * ONE // 2, -5 * ONE // 2, ONE // 2 + 1, 7 * ONE // 2)
+        self.assertEqual([_chop_precision_and_round(value) for value in values], [0, 2, 2, -2, 1, 4])
+        self.assertEqual(sdk_mul(ONE // 2, 1), 0)
+        self.assertEqual(sdk_mul(3 * ONE // 2, 1), 2)
+
+    def test_quo_truncates_before_rounding(self):
+        # 1 / 3 = 0.333...
+        self.assertEqual(sdk_quo(ONE, 3 * ONE), 333333333333333333)
+        # 2 / 3 = 0.666... rounds up in the last place
+        self.assertEqual(sdk_quo(2 * ONE, 3 * ONE), 666666666666666667)
+        self.assertEqual(sdk_quo(-2 * ONE, 3 * ONE), -666666666666666667)
+
+    def test_min_spread(self):
+        # 1 Luna at 80 UST and 60 SDR into a deep pool pays the minimum spread of 0.5%.
+        self.assertEqual(market_swap(10 ** 6, True, ONE, 80 * ONE, 60 * ONE, 10 ** 13 * ONE, 0, MIN_SPREAD),
+                         (79600000, MIN_SPREAD, 400000))
+
+    def test_pool_spread(self):
+        # spread = 6e7 / (1e9 + 6e7) = 3 / 53 to 18 decimals
+        self.assertEqual(market_swap(10 ** 6, True, ONE, 80 * ONE, 60 * ONE, 10 ** 9 * ONE, 0, MIN_SPREAD),
+                         (75471698, 56603773584905660, 4528301))
+
+
+if __name__ == '__main__':
+    unittest.main()
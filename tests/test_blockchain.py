@@ -0,0 +1,120 @@
+from types import SimpleNamespace
+from aiohttp import web
+from src.wallet import BlockChain
+import asyncio
+import unittest
+
+
+def block(height: int) -> dict:
+    return {'header': {'height': str(height), 'time': f'2022-05-01T00:00:{height % 60:02d}.123456789Z'},
+            'data': {'txs': []}}
+
+
+def new_block_event(height: int) -> dict:
+    return {'jsonrpc': '2.0', 'id': 0,
+            'result': {'query': "tm.event='NewBlock'",
+                       'data': {'type': 'tendermint/event/NewBlock', 'value': {'block': block(height)}}}}
+
+
+class StandInNode:
+    """Tendermint RPC websocket pushing `heights` as new blocks, and an LCD serving `height`
+    """
+
+    def __init__(self, heights=(), error=None):
+        self.heights = heights
+        self.error = error
+        self.height = 1
+        self.subscriptions = []
+        self.runner = None
+        self.lcd = SimpleNamespace(tendermint=SimpleNamespace(block_info=self.block_info))
+
+    async def block_info(self):
+        return {'block': block(self.height)}
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.subscriptions.append(await ws.receive_json())
+        if self.error:
+            await ws.send_json({'jsonrpc': '2.0', 'id': 0, 'error': self.error})
+        else:
+            await ws.send_json({'jsonrpc': '2.0', 'id': 0, 'result': {}})
+            for height in self.heights:
+                self.height = height
+                await ws.send_json(new_block_event(height))
+        await ws.close()
+        return ws
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_get('/websocket', self.websocket)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        return f'ws://{host}:{port}/websocket'
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+async def take(blockchain: BlockChain, n: int) -> list:
+    """Heights of the first `n` blocks of `blockchain`
+    """
+    heights = []
+    blocks = blockchain.__aiter__()
+    try:
+        async for res in blocks:
+            heights.append(int(res['header']['height']))
+            if len(heights) == n:
+                return heights
+    finally:
+        await blocks.aclose()
+
+
+class TestSubscription(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.node = StandInNode()
+
+    async def asyncTearDown(self):
+        if self.node.runner:
+            await self.node.stop()
+
+    async def test_new_blocks(self):
+        self.node.heights = (10, 11, 12)
+        blockchain = BlockChain(self.node.lcd, await self.node.start())
+        heights = await asyncio.wait_for(take(blockchain, 3), 5)
+        self.assertEqual(heights, [10, 11, 12])
+        self.assertEqual(self.node.subscriptions[0]['params'], {'query': "tm.event='NewBlock'"})
+        self.assertEqual(blockchain.initial_block, 10)
+        # Arrival of blocks is observed as with polling.
+        self.assertEqual(blockchain.timer.height, 12)
+
+    async def test_duplicates(self):
+        self.node.heights = (10, 10, 9, 11)
+        blockchain = BlockChain(self.node.lcd, await self.node.start())
+        self.assertEqual(await asyncio.wait_for(take(blockchain, 2), 5), [10, 11])
+
+    async def test_error_falls_back_to_polling(self):
+        self.node.error = {'code': -32603, 'message': 'subscription limit'}
+        self.node.height = 7
+        blockchain = BlockChain(self.node.lcd, await self.node.start())
+        self.assertEqual(await asyncio.wait_for(take(blockchain, 1), 5), [7])
+
+    async def test_unreachable_falls_back_to_polling(self):
+        self.node.height = 7
+        blockchain = BlockChain(self.node.lcd, 'ws://127.0.0.1:1/websocket')
+        self.assertEqual(await asyncio.wait_for(take(blockchain, 1), 5), [7])
+
+    async def test_closed_falls_back_to_polling(self):
+        self.node.heights = (10,)
+        blockchain = BlockChain(self.node.lcd, await self.node.start())
+        # The websocket closes after height 10, which the LCD keeps serving until height 11.
+        asyncio.get_running_loop().call_later(0.2, setattr, self.node, 'height', 11)
+        self.assertEqual(await asyncio.wait_for(take(blockchain, 2), 5), [10, 11])
+
+
+if __name__ == '__main__':
+    unittest.main()